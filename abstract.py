@@ -28,6 +28,12 @@ Like this: 'class Player(abstract.AbstractPlayer):'
         """
         raise NotImplementedError
 
+    def close(self):
+        """Called by the game runner once the game is over. The player should stop any work it left running in the
+        background (e.g. pondering).
+        """
+        pass
+
     def __repr__(self):
         return self.color
 
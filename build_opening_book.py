@@ -0,0 +1,90 @@
+"""
+Builds an opening book (see checkers/opening_book.py) by searching the positions of the first plies of the game.
+"""
+import sys
+from checkers.board import GameState
+from checkers.consts import RED_PLAYER, BLACK_PLAYER
+from checkers.moves import encode_move
+from checkers.opening_book import write_book
+from utils import INFINITY
+
+# The moves whose value is within this fraction of the player's aspiration window (half a piece for our players) of
+# the best move are kept too.
+BOOK_MARGIN = 0.5
+# The weight of the best move of a position. The other kept moves get less, down to a quarter at the margin.
+BOOK_MAX_WEIGHT = 1000
+
+
+def analyse_position(state, player, depth, margin, max_moves):
+    """Searches every move of the position to the given depth with the player's minimax.
+
+    :return: The list of the (move, weight) worth playing, best first.
+    """
+    minimax = player.create_minimax()
+    values = []
+    for move in state.get_possible_moves():
+        undo = state.make_move(move)
+        value, _ = minimax.search(state, depth - 1, -INFINITY, INFINITY, False, 1)
+        state.unmake_move(undo)
+        values.append((value, move))
+    values.sort(key=lambda value_move: -value_move[0])
+
+    best_value = values[0][0]
+    book_moves = []
+    for value, move in values[:max_moves]:
+        if best_value - value > margin:
+            break
+        weight = BOOK_MAX_WEIGHT * (1 - 0.75 * (best_value - value) / margin) if margin else BOOK_MAX_WEIGHT
+        book_moves.append((move, max(1, int(weight))))
+    return book_moves
+
+
+def build_opening_book(player_module, plies, depth, path, max_moves=2):
+    """Builds a book of the positions reached in the first plies by playing the book moves of both players from the
+    initial position. Positions reached by different move orders are searched once.
+
+    :param player_module: The module of the player whose search chooses the moves, e.g. 'simple_player'.
+    :param plies: The number of plies the book covers.
+    :param depth: The depth of the search of every move.
+    :param path: The path of the book file.
+    :param max_moves: The maximal number of moves kept per position.
+    """
+    module_name = 'players.{}'.format(player_module)
+    __import__(module_name)
+    player_class = sys.modules[module_name].Player
+    players = {color: player_class(INFINITY, color, INFINITY, 1) for color in (RED_PLAYER, BLACK_PLAYER)}
+    margin = BOOK_MARGIN * players[RED_PLAYER].aspiration_window
+    for player in players.values():
+        player.deadline.start(INFINITY)
+
+    entries = {}
+    frontier = [GameState()]
+    for ply in range(plies):
+        next_frontier = []
+        for state in frontier:
+            if state.key in entries or not state.get_possible_moves():
+                continue
+            book_moves = analyse_position(state, players[state.curr_player], depth, margin, max_moves)
+            entries[state.key] = [(encode_move(move), weight) for move, weight in book_moves]
+            for move, _ in book_moves:
+                next_state = state.copy()
+                next_state.make_move(move)
+                next_frontier.append(next_state)
+        print('ply {}: {} positions in the book'.format(ply + 1, len(entries)))
+        frontier = next_frontier
+
+    write_book(path, entries)
+
+
+if __name__ == '__main__':
+    try:
+        player_module, plies, depth, path = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4]
+        max_moves = int(sys.argv[5]) if len(sys.argv) > 5 else 2
+    except (IndexError, ValueError):
+        print("""Syntax: {0} player plies depth path [max_moves]
+For example: {0} AI2_313298424_034477588.improved_better_h_player 8 6 opening.book 2
+Searches the first plies positions with the player's minimax to the given depth, keeping up to max_moves good moves
+per position, and writes the book to path.""".
+              format(sys.argv[0]))
+    else:
+        build_opening_book(player_module, plies, depth, path, max_moves)
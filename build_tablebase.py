@@ -0,0 +1,65 @@
+"""
+Builds the endgame tablebases (see checkers/tablebase.py) of all the positions with up to a given number of pieces.
+"""
+import os
+import sys
+import time
+import multiprocessing
+from checkers.tablebase import all_slices, slice_level, slice_name, dependency_slices, solve_slice, read_table, \
+    write_table, FORMAT_DTW, FORMAT_WDL
+
+
+def build_slice(material, directory, table_format):
+    """Solves a slice and writes its file. The slices it depends on must already be in the directory.
+
+    :return: A tuple: (The material, the time it took in seconds)
+    """
+    start = time.time()
+    dependencies = {other: read_table(os.path.join(directory, slice_name(other)))
+                    for other in dependency_slices(material)}
+    values = solve_slice(material, dependencies)
+    write_table(os.path.join(directory, slice_name(material)), material, values, table_format)
+    return material, time.time() - start
+
+
+def build_tablebases(max_pieces, directory, processes=1, table_format=FORMAT_DTW):
+    """Builds the missing slice files of up to max_pieces pieces, level by level (see slice_level). The slices of a
+    level are solved in parallel. Slices that already have a file are skipped, so an interrupted build continues
+    where it stopped.
+
+    :param max_pieces: The maximal number of pieces on the board.
+    :param directory: The directory of the files.
+    :param processes: The number of worker processes.
+    :param table_format: FORMAT_DTW or FORMAT_WDL.
+    """
+    os.makedirs(directory, exist_ok=True)
+    levels = {}
+    for material in all_slices(max_pieces):
+        if not os.path.exists(os.path.join(directory, slice_name(material))):
+            levels.setdefault(slice_level(material), []).append(material)
+
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        for level in sorted(levels):
+            jobs = [(material, directory, table_format) for material in levels[level]]
+            results = pool.starmap(build_slice, jobs) if pool else [build_slice(*job) for job in jobs]
+            for material, run_time in results:
+                print('solved {} in {:.1f} seconds'.format(slice_name(material), run_time))
+    finally:
+        if pool:
+            pool.close()
+
+
+if __name__ == '__main__':
+    try:
+        max_pieces, directory = int(sys.argv[1]), sys.argv[2]
+        processes = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        table_format = FORMAT_WDL if len(sys.argv) > 4 and sys.argv[4].lower() == 'wdl' else FORMAT_DTW
+    except (IndexError, ValueError):
+        print("""Syntax: {0} max_pieces directory [processes] [dtw|wdl]
+For example: {0} 4 tablebases 4 dtw
+Builds the tablebases of all the positions with up to max_pieces pieces into directory, in parallel over processes.
+dtw files keep the distance to win in one byte per position, wdl files only the result in 2 bits per position.""".
+              format(sys.argv[0]))
+    else:
+        build_tablebases(max_pieces, directory, processes, table_format)
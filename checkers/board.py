@@ -1,140 +1,451 @@
 """A game-specific implementations of utility functions.
 """
 from __future__ import print_function, division
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 from .consts import *
 from .moves import *
+from .zobrist import ZOBRIST_SQUARE_KEYS, BLACK_TO_MOVE_KEY, compute_key
+from .evaluation import IncrementalEvaluation
 
+#===============================================================================
+# Board View
+#===============================================================================
+
+# All the board locations, in the order the board dictionary of the game used to have.
+BOARD_LOCS = tuple((i, j)
+                   for j in range(BOARD_COLS)
+                   for i in range(BOARD_ROWS))
+# location -> its square number, or None for the light squares that never hold a tool.
+BOARD_SLOTS = {loc: SQUARE_INDEX.get(loc) for loc in BOARD_LOCS}
+# The square number of every location of BOARD_LOCS, NUM_SQUARES (one past the last square) for the light squares.
+BOARD_SLOT_INDEXES = tuple(NUM_SQUARES if BOARD_SLOTS[loc] is None else BOARD_SLOTS[loc] for loc in BOARD_LOCS)
+
+
+class BoardView(Mapping):
+    """A read-only (row, col) -> tool mapping of the whole board, over the compact cells of a GameState. It is what
+    GameState.board returns, so code reading the board as a dictionary keeps working. It follows the changes of the
+    state.
+    """
+    __slots__ = ('cells',)
+
+    def __init__(self, cells):
+        """
+        :param cells: The bytearray of the tool codes of the playable squares (see GameState.cells).
+        """
+        self.cells = cells
+
+    def __getitem__(self, loc):
+        n = BOARD_SLOTS[loc]
+        return EM if n is None else CODE_TOOLS[self.cells[n]]
+
+    def __iter__(self):
+        return iter(BOARD_LOCS)
+
+    def __len__(self):
+        return len(BOARD_LOCS)
+
+    def __contains__(self, loc):
+        return loc in BOARD_SLOTS
+
+    def values(self):
+        # A trailing EM stands for all the light squares.
+        tools = [CODE_TOOLS[code] for code in self.cells]
+        tools.append(EM)
+        return [tools[n] for n in BOARD_SLOT_INDEXES]
+
+    def items(self):
+        return list(zip(BOARD_LOCS, self.values()))
+
+#===============================================================================
+# Game State
+#===============================================================================
 
 class GameState:
     def __init__(self):
         """ Initializing the board and current player.
         """
-        self.board = {(i,j) : EM 
-                      for j in range(BOARD_COLS) 
-                      for i in range(BOARD_ROWS)}
-        
-        for i in range(3):
-            for j in range(BOARD_COLS):
-                if IS_BLACK_TILE((i,j)):
-                    self.board[(i,j)] = RP
-        
-        for i in range(3):
-            cur_i = BOARD_ROWS - i - 1
-            for j in range(BOARD_COLS):
-                if IS_BLACK_TILE((cur_i,j)):
-                    self.board[(cur_i,j)] = BP
-                    
+        # The tool codes (see TOOL_CODES) of the playable squares, indexed by the square number (see
+        # PLAYABLE_SQUARES). The light squares never hold a tool, so they are not kept.
+        self.cells = bytearray(NUM_SQUARES)
+        for n, (i, j) in enumerate(PLAYABLE_SQUARES):
+            if i < 3:
+                self.cells[n] = RP_CODE
+            elif i >= BOARD_ROWS - 3:
+                self.cells[n] = BP_CODE
+        self.board = BoardView(self.cells)
+
         self.curr_player = RED_PLAYER
         self.turns_since_last_jump = 0
 
+        # The Zobrist key of the position, kept up to date by make_move and unmake_move.
+        self.key = compute_key(self.board, self.curr_player)
+        # The incremental evaluation terms, None until enable_evaluation is called.
+        self.evaluation = None
+
+    def copy(self):
+        """A copy of the state, made by copying its cells. The incremental evaluation terms are not copied (see
+        enable_evaluation).
+        """
+        state = self.__class__.__new__(self.__class__)
+        state.cells = bytearray(self.cells)
+        state.board = BoardView(state.cells)
+        state.curr_player = self.curr_player
+        state.turns_since_last_jump = self.turns_since_last_jump
+        state.key = self.key
+        state.evaluation = None
+        return state
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def encode(self):
+        """Encodes the state compactly, e.g. to send it to another process: the bitboards (bit n for the square
+        number n, see PLAYABLE_SQUARES) of the RP, RK, BP and BK tools, the current player and turns_since_last_jump.
+        """
+        pieces = [0] * len(CODE_TOOLS)
+        for n, code in enumerate(self.cells):
+            pieces[code] |= 1 << n
+        return (pieces[RP_CODE], pieces[RK_CODE], pieces[BP_CODE], pieces[BK_CODE], self.curr_player,
+                self.turns_since_last_jump)
+
+    @classmethod
+    def decode(cls, code):
+        """Builds a state from the result of encode.
+        """
+        state = cls.__new__(cls)
+        state.cells = bytearray(NUM_SQUARES)
+        for tool_code, bb in zip((RP_CODE, RK_CODE, BP_CODE, BK_CODE), code[:4]):
+            for n in range(NUM_SQUARES):
+                if bb >> n & 1:
+                    state.cells[n] = tool_code
+        state.board = BoardView(state.cells)
+        state.curr_player = code[4]
+        state.turns_since_last_jump = code[5]
+        state.key = compute_key(state.board, state.curr_player)
+        state.evaluation = None
+        return state
+
+    def enable_evaluation(self, piece_square_tables):
+        """Starts keeping the incremental evaluation terms of the state (see checkers.evaluation), which make_move and
+        unmake_move update from now on. If they are already kept for the same tables, nothing is recomputed.
+        :param piece_square_tables: The piece-square tables whose sums are kept.
+        :return: The IncrementalEvaluation of the state.
+        """
+        if self.evaluation is None or self.evaluation.piece_square_tables is not piece_square_tables:
+            self.evaluation = IncrementalEvaluation(self.board, piece_square_tables)
+        return self.evaluation
+
     def calc_single_moves(self):
         """Calculating all the possible single moves.
         :return: All the legitimate single moves for this game state.
         """
-        single_pawn_moves = [GameMove(self.board[i], i, j) 
-                             for (i, js) in PAWN_SINGLE_MOVES[self.curr_player].items()
-                             if self.board[i] == PAWN_COLOR[self.curr_player]
-                             for j in js
-                             if self.board[j] == EM]
-        single_king_moves = [GameMove(self.board[i], i, j)
-                             for (i, js) in KING_SINGLE_MOVES.items()
-                             if self.board[i] == KING_COLOR[self.curr_player]
-                             for j in js
-                             if self.board[j] == EM]
-        return single_pawn_moves + single_king_moves
+        cells = self.cells
+        pawn = PAWN_CODE[self.curr_player]
+        king = KING_CODE[self.curr_player]
+        pawn_moves = SINGLE_MOVE_TABLE[PAWN_COLOR[self.curr_player]]
+        king_moves = SINGLE_MOVE_TABLE[KING_COLOR[self.curr_player]]
+        single_moves = []
+        for n, code in enumerate(cells):
+            if code == pawn:
+                moves = pawn_moves[n]
+            elif code == king:
+                moves = king_moves[n]
+            else:
+                continue
+            # The single moves are shared, see SINGLE_MOVE_TABLE.
+            for target, move in moves:
+                if cells[target] == EM_CODE:
+                    single_moves.append(move)
+        return single_moves
 
     def calc_capture_moves(self):
         """Calculating all the possible capture moves, but only the first step.
-        :return: All the legitimate single capture moves for this game state.
-        """
-        capture_pawn_moves = [(i, j, k)
-                              for i, i_capts in PAWN_CAPTURE_MOVES[self.curr_player].items()
-                              if self.board[i] == PAWN_COLOR[self.curr_player]
-                              for j,k in i_capts
-                              if self.board[j] in OPPONENT_COLORS[self.curr_player]
-                              and self.board[k] == EM]
-        capture_king_moves = [(i, j, k)
-                              for i, i_capts in KING_CAPTURE_MOVES.items()
-                              if self.board[i] == KING_COLOR[self.curr_player]
-                              for j,k in i_capts
-                              if self.board[j] in OPPONENT_COLORS[self.curr_player]
-                              and self.board[k] == EM]
-        return capture_pawn_moves + capture_king_moves
-    
-    def find_all_capture_sequence(self, origin_loc, cur_loc, possible_moves, already_jumped):
-        """
-        Calculating all possible capture sequences from cur_loc, using moves in
-        possible_moves, avoiding jumping locations in already_jumped
-        
+        :return: All the legitimate single capture moves for this game state, as (origin, jumped, target) tuples.
+        """
+        return [(PLAYABLE_SQUARES[n], PLAYABLE_SQUARES[jumped], PLAYABLE_SQUARES[target])
+                for n, jumped, target in self._capture_steps()]
+
+    def _capture_steps(self):
+        """
+        :return: The first steps of all the captures, as (origin, jumped, target) square numbers.
+        """
+        cells = self.cells
+        pawn = PAWN_CODE[self.curr_player]
+        king = KING_CODE[self.curr_player]
+        pawn_jump_squares = PAWN_JUMP_SQUARES[self.curr_player]
+        opponent_codes = OPPONENT_CODES[self.curr_player]
+        capture_steps = []
+        for n, code in enumerate(cells):
+            if code == pawn:
+                jumps = pawn_jump_squares[n]
+            elif code == king:
+                jumps = KING_JUMP_SQUARES[n]
+            else:
+                continue
+            for jumped, target in jumps:
+                if cells[jumped] in opponent_codes and cells[target] == EM_CODE:
+                    capture_steps.append((n, jumped, target))
+        return capture_steps
+
+    def capture_sequences(self, origin, jumps):
+        """
+        Generates all the capture sequences of the tool on origin, walking the jumps
+        depth first with an explicit stack. The jumped tools are kept in a bitmask, and a
+        sequence is yielded once it cannot jump any further. Sequences that jump the same
+        tools and end on the same square (e.g. a king going around a loop in either
+        direction) lead to the same state, and only the first of them is yielded.
+
         Arguments:
-        cur_loc: 2-tuple containing origin location for jump sequence
-        possible_moves: all jump moves allowed for player whos sequences we are calculating
-        already_jumped: list of 2-tuples of locations of players previously eaten in current sequence
-        
-        :return: list of 2-tuples where:
-            [0] Sequence final location
-            [1] list of jumped tools by this sequence
-        """
-        possible_next_jumps = [(jumped, next_loc)
-                               for jumped, next_loc in possible_moves[cur_loc]
-                               if self.board[jumped] in OPPONENT_COLORS[self.curr_player] # Jumping opponent tool
-                               and (self.board[next_loc] == EM or next_loc == origin_loc)# Target location is empty
-                               and jumped not in already_jumped] # I have not jumped this tool yet in this sequence
-        
-        capture_seqs = []
-        for jumped, next_loc in possible_next_jumps:
-            cur_seqs = self.find_all_capture_sequence(origin_loc,
-                                                      next_loc, 
-                                                      possible_moves,
-                                                      already_jumped + [jumped])
-            for target, seq in cur_seqs:
-                capture_seqs.append((target, [jumped] + seq))
-        
-        if len(capture_seqs) == 0:
-            return [(cur_loc,[])]
-        else:
-            return capture_seqs
-    
+        origin: the square number the moving tool starts from
+        jumps: the square number jump table of the moving tool (see TOOL_JUMP_SQUARES)
+
+        :yield: 3-tuples where:
+            [0] Sequence final square
+            [1] tuple of the jumped squares, in the order they are jumped
+            [2] bitmask of the jumped squares (bit n for square number n)
+        """
+        cells = self.cells
+        opponent_codes = OPPONENT_CODES[self.curr_player]
+        seen = set()
+        # The squares jumped so far, one per stack frame above the first.
+        path = []
+        jumped_mask = 0
+        # Frames of [square, index of the next jump to try, whether a jump was made from the square].
+        stack = [[origin, 0, False]]
+        while stack:
+            frame = stack[-1]
+            cur_jumps = jumps[frame[0]]
+            i = frame[1]
+            while i < len(cur_jumps):
+                jumped, target = cur_jumps[i]
+                i += 1
+                if (cells[jumped] in opponent_codes # Jumping opponent tool
+                        and (cells[target] == EM_CODE or target == origin) # Target location is empty
+                        and not jumped_mask >> jumped & 1): # I have not jumped this tool yet in this sequence
+                    break
+            else:
+                # No more jumps from this square.
+                stack.pop()
+                if not frame[2]:
+                    final = frame[0]
+                    if (final, jumped_mask) not in seen:
+                        seen.add((final, jumped_mask))
+                        yield final, tuple(path), jumped_mask
+                if path:
+                    jumped_mask ^= 1 << path.pop()
+                continue
+
+            frame[1] = i
+            frame[2] = True
+            path.append(jumped)
+            jumped_mask |= 1 << jumped
+            stack.append([target, 0, False])
+
+    def has_any_move(self):
+        """Checks whether the current player has a legal move, stopping at the first one found. Cheaper than
+        get_possible_moves: no capture sequence is followed and no GameMove is built.
+        :return: True if the current player can move.
+        """
+        cells = self.cells
+        pawn = PAWN_CODE[self.curr_player]
+        king = KING_CODE[self.curr_player]
+        opponent_codes = OPPONENT_CODES[self.curr_player]
+        for n, code in enumerate(cells):
+            if code == pawn:
+                targets = PAWN_SINGLE_SQUARES[self.curr_player][n]
+                jumps = PAWN_JUMP_SQUARES[self.curr_player][n]
+            elif code == king:
+                targets = KING_SINGLE_SQUARES[n]
+                jumps = KING_JUMP_SQUARES[n]
+            else:
+                continue
+            for target in targets:
+                if cells[target] == EM_CODE:
+                    return True
+            for jumped, target in jumps:
+                if cells[jumped] in opponent_codes and cells[target] == EM_CODE:
+                    return True
+        return False
+
+    def mobility(self, player=None):
+        """Counts the moves of a player as if it was his turn, without building them. If the player can capture,
+        these are the first steps of his captures (a multiple jump counts once per first jump), otherwise his single
+        moves.
+        :param player: The player, the current player by default.
+        :return: The number of moves, 0 if the player cannot move.
+        """
+        if player is None:
+            player = self.curr_player
+        cells = self.cells
+        pawn = PAWN_CODE[player]
+        king = KING_CODE[player]
+        opponent_codes = OPPONENT_CODES[player]
+        single_count = 0
+        capture_count = 0
+        for n, code in enumerate(cells):
+            if code == pawn:
+                targets = PAWN_SINGLE_SQUARES[player][n]
+                jumps = PAWN_JUMP_SQUARES[player][n]
+            elif code == king:
+                targets = KING_SINGLE_SQUARES[n]
+                jumps = KING_JUMP_SQUARES[n]
+            else:
+                continue
+            for jumped, target in jumps:
+                if cells[jumped] in opponent_codes and cells[target] == EM_CODE:
+                    capture_count += 1
+            if not capture_count:
+                for target in targets:
+                    if cells[target] == EM_CODE:
+                        single_count += 1
+        return capture_count or single_count
+
+    def generate_captures(self):
+        """Generates the capture moves, one tool after the other, in the order of get_possible_moves. Nothing is
+        generated when the current player cannot capture.
+        """
+        capture_steps = self._capture_steps()
+        # The steps are in square order, so are the origins.
+        for origin in dict.fromkeys(origin for origin, _, _ in capture_steps):
+            tool = CODE_TOOLS[self.cells[origin]]
+            for target, seq, _ in self.capture_sequences(origin, TOOL_JUMP_SQUARES[tool]):
+                yield GameMove.from_squares(tool, origin, target, seq)
+
+    def generate_single_moves(self):
+        """Generates the single moves, one tool after the other, in the order of calc_single_moves. It does not
+        check for captures: these moves are legal only if the current player cannot capture.
+        """
+        cells = self.cells
+        pawn = PAWN_CODE[self.curr_player]
+        king = KING_CODE[self.curr_player]
+        pawn_moves = SINGLE_MOVE_TABLE[PAWN_COLOR[self.curr_player]]
+        king_moves = SINGLE_MOVE_TABLE[KING_COLOR[self.curr_player]]
+        for n in range(NUM_SQUARES):
+            code = cells[n]
+            if code == pawn:
+                moves = pawn_moves[n]
+            elif code == king:
+                moves = king_moves[n]
+            else:
+                continue
+            for target, move in moves:
+                if cells[target] == EM_CODE:
+                    yield move
+
+    def generate_moves(self):
+        """Generates the possible moves in stages: the captures first, since they are mandatory, and only if there
+        are none the single moves, one tool after the other. These are the moves of get_possible_moves, but a
+        consumer that stops early (e.g. on an alpha-beta cutoff) does not pay for the rest.
+        The state may be changed between the moves, as long as it is restored before the next one is taken (as
+        make_move and unmake_move do).
+        """
+        has_captures = False
+        for move in self.generate_captures():
+            has_captures = True
+            yield move
+        if not has_captures:
+            for move in self.generate_single_moves():
+                yield move
+
+    def legal_single_move(self, code):
+        """
+        :param code: A move code (see GameMove), e.g. from a transposition table or a killer slot.
+        :return: The single move of the current player with this code if it can be played in this state, assuming the
+                 player cannot capture. Otherwise None.
+        """
+        tool_code = self.cells[code & 0x1F]
+        if tool_code != PAWN_CODE[self.curr_player] and tool_code != KING_CODE[self.curr_player]:
+            return None
+        move = single_move_of_code(CODE_TOOLS[tool_code], code)
+        if move is None or self.cells[(code >> 5) & 0x1F] != EM_CODE:
+            return None
+        return move
+
     def get_possible_moves(self):
         """Return a list of possible moves for this state.
         Each possible move is represented by GameMove object.
         """
-        possible_capture_moves = self.calc_capture_moves()
-        if possible_capture_moves:
-            capture_origins = set(origin for origin,_,_ in possible_capture_moves)
-            capture_seqs = []
-            for origin in capture_origins:
-                cur_seqs = self.find_all_capture_sequence(origin, origin,
-                                                          TOOL_CAPTURE_MOVES[self.board[origin]], 
-                                                          [])
-                for target, seq in cur_seqs:
-                    capture_seqs.append(GameMove(self.board[origin], origin, target, seq))
-                    
+        capture_seqs = list(self.generate_captures())
+        if capture_seqs:
             return capture_seqs
 
         # There were no capture moves. We return the single moves.
         return self.calc_single_moves()
 
     def perform_move(self, move):
-        self.board[move.origin_loc] = EM
-        if (move.player_type == PAWN_COLOR[self.curr_player]
-            and move.target_loc[0] == BACK_ROW[self.curr_player]):
+        self.make_move(move)
+
+    def make_move(self, move):
+        """Performs the given move in place, like perform_move, and returns what is needed to take it back.
+        :return: An undo record to pass to unmake_move.
+        """
+        cells = self.cells
+        # The squares are read from the move code (see GameMove).
+        code = move.code
+        origin = code & 0x1F
+        target = (code >> 5) & 0x1F
+        jumped = []
+        jumped_mask = code >> 10
+        while jumped_mask:
+            low = jumped_mask & -jumped_mask
+            jumped.append(low.bit_length() - 1)
+            jumped_mask ^= low
+        moved = TOOL_CODES[move.player_type]
+        undo = (origin, moved, target, cells[target], [(n, cells[n]) for n in jumped],
+                self.curr_player, self.turns_since_last_jump, self.key)
+
+        key = self.key ^ ZOBRIST_SQUARE_KEYS[move.player_type][origin] ^ BLACK_TO_MOVE_KEY
+        cells[origin] = EM_CODE
+        if moved == PAWN_CODE[self.curr_player] and PROMOTION_SQUARES[self.curr_player][target]:
             # If moved pawn to back row, turn to king and put in target
-            self.board[move.target_loc] = KING_COLOR[self.curr_player]
+            cells[target] = KING_CODE[self.curr_player]
         else:
             # Move tool to target
-            self.board[move.target_loc] = move.player_type
-        
-        for loc in move.jumped_locs:
-            self.board[loc] = EM
-        if len(move.jumped_locs) > 0:
+            cells[target] = moved
+        key ^= ZOBRIST_SQUARE_KEYS[CODE_TOOLS[cells[target]]][target]
+
+        if self.evaluation is not None:
+            self.evaluation.remove(move.player_type, move.origin_loc)
+            self.evaluation.add(CODE_TOOLS[cells[target]], move.target_loc)
+            for n in jumped:
+                self.evaluation.remove(CODE_TOOLS[cells[n]], PLAYABLE_SQUARES[n])
+
+        for n in jumped:
+            key ^= ZOBRIST_SQUARE_KEYS[CODE_TOOLS[cells[n]]][n]
+            cells[n] = EM_CODE
+        self.key = key
+        if len(jumped) > 0:
             self.turns_since_last_jump = 0
         else:
-            self.turns_since_last_jump += 0.5        
-        
+            self.turns_since_last_jump += 0.5
+
         # Updating the current player.
         self.curr_player = OPPONENT_COLOR[self.curr_player]
-        
+        return undo
+
+    def unmake_move(self, undo):
+        """Takes back the move that returned the given undo record. Moves must be taken back in the reverse order
+        they were made.
+        """
+        origin, moved, target, target_code, jumped, curr_player, turns_since_last_jump, key = undo
+        cells = self.cells
+        if self.evaluation is not None:
+            self.evaluation.remove(CODE_TOOLS[cells[target]], PLAYABLE_SQUARES[target])
+            self.evaluation.add(CODE_TOOLS[moved], PLAYABLE_SQUARES[origin])
+            for n, code in jumped:
+                self.evaluation.add(CODE_TOOLS[code], PLAYABLE_SQUARES[n])
+        # The target is restored first, since a capture sequence may end on its own origin.
+        cells[target] = target_code
+        cells[origin] = moved
+        for n, code in jumped:
+            cells[n] = code
+        self.curr_player = curr_player
+        self.turns_since_last_jump = turns_since_last_jump
+        self.key = key
+
     def draw_board(self):
         print("  " + " ".join([str(i) for i in range(BOARD_COLS)]))
         line_sep = " +" + "-+"*BOARD_COLS
@@ -149,10 +460,9 @@ class GameState:
         """This object can be inserted into a set or as dict key. NOTICE: Changing the object after it has been inserted
         into a set or dict (as key) may have unpredicted results!!!
         """
-        return hash(','.join([self.board[(i,j)]
-                              for i in range(BOARD_ROWS)
-                              for j in range(BOARD_COLS)] + [self.curr_player]))
+        return self.key
 
     def __eq__(self, other):
-        return isinstance(other, GameState) and self.board == other.board and self.curr_player == other.curr_player
-
+        # Different keys always mean different positions, equal keys are verified on the board itself.
+        return (isinstance(other, GameState) and self.key == other.key
+                and self.cells == other.cells and self.curr_player == other.curr_player)
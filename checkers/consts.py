@@ -54,3 +54,29 @@ OPPONENT_COLOR = {
 
 # Max turns since last Jump
 MAX_TURNS_NO_JUMP = 50
+
+# The playable (dark) squares, numbered 0..31 row by row. This is the numbering
+# used by the compact board representations.
+PLAYABLE_SQUARES = [(i, j)
+                    for i in range(BOARD_ROWS)
+                    for j in range(BOARD_COLS)
+                    if IS_BLACK_TILE((i, j))]
+SQUARE_INDEX = {loc: n for n, loc in enumerate(PLAYABLE_SQUARES)}
+NUM_SQUARES = len(PLAYABLE_SQUARES)
+
+# The small integer codes of the tools, as kept by the compact board of
+# checkers.board.GameState (one byte per playable square).
+EM_CODE, RP_CODE, RK_CODE, BP_CODE, BK_CODE = range(5)
+TOOL_CODES = {
+    EM: EM_CODE,
+    RP: RP_CODE,
+    RK: RK_CODE,
+    BP: BP_CODE,
+    BK: BK_CODE,
+}
+# The tool of every code, indexed by the code.
+CODE_TOOLS = (EM, RP, RK, BP, BK)
+
+PAWN_CODE = {player: TOOL_CODES[tool] for player, tool in PAWN_COLOR.items()}
+KING_CODE = {player: TOOL_CODES[tool] for player, tool in KING_COLOR.items()}
+OPPONENT_CODES = {player: tuple(TOOL_CODES[tool] for tool in tools) for player, tools in OPPONENT_COLORS.items()}
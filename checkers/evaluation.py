@@ -0,0 +1,75 @@
+"""Incremental evaluation terms of a game state.
+
+An IncrementalEvaluation attached to a checkers.board.GameState (see GameState.enable_evaluation) holds the piece
+counts, the locations of every tool and the sums of piece-square tables over the pieces of each player, and is kept up
+to date by make_move and unmake_move. A utility can then read the material and positional terms of a position without
+going over the board. States are created without it, so players that do not use it pay nothing.
+"""
+from __future__ import print_function, division
+from .consts import RP, RK, BP, BK, EM, RED_PLAYER, BLACK_PLAYER
+
+#===============================================================================
+# Constants
+#===============================================================================
+
+# The player owning each tool.
+TOOL_PLAYER = {
+    RP: RED_PLAYER,
+    RK: RED_PLAYER,
+    BP: BLACK_PLAYER,
+    BK: BLACK_PLAYER,
+}
+
+#===============================================================================
+# Evaluation
+#===============================================================================
+
+class IncrementalEvaluation:
+    """The piece counts, locations and piece-square sums of a board.
+
+    The sums are updated by adding and subtracting the table values, so they equal the sums of a full pass over the
+    board exactly as long as the values and their sums are exact in floating point (e.g. integers or halves).
+    """
+
+    def __init__(self, board, piece_square_tables):
+        """
+        :param board: A (row, col) -> tool dictionary of the board.
+        :param piece_square_tables: A sequence of tool -> {(row, col): score} tables. For every table, the sum of the
+                                    scores of the pieces of each player is maintained.
+        """
+        self.piece_square_tables = piece_square_tables
+        # tool -> the number of pieces of that tool.
+        self.counts = {RP: 0, RK: 0, BP: 0, BK: 0}
+        # tool -> the set of the locations of the pieces of that tool.
+        self.locs = {RP: set(), RK: set(), BP: set(), BK: set()}
+        # For every table, player -> the sum of the table's scores of the player's pieces.
+        self.sums = [{RED_PLAYER: 0, BLACK_PLAYER: 0} for _ in piece_square_tables]
+        for loc, tool in board.items():
+            if tool != EM:
+                self.add(tool, loc)
+
+    def add(self, tool, loc):
+        """Accounts for a tool placed on the given location.
+        """
+        player = TOOL_PLAYER[tool]
+        self.counts[tool] += 1
+        self.locs[tool].add(loc)
+        for sums, table in zip(self.sums, self.piece_square_tables):
+            sums[player] += table[tool][loc]
+
+    def remove(self, tool, loc):
+        """Accounts for a tool taken off the given location.
+        """
+        player = TOOL_PLAYER[tool]
+        self.counts[tool] -= 1
+        self.locs[tool].discard(loc)
+        for sums, table in zip(self.sums, self.piece_square_tables):
+            sums[player] -= table[tool][loc]
+
+    def pieces(self, player):
+        """
+        :return: The number of pieces (pawns and kings) of the player.
+        """
+        if player == RED_PLAYER:
+            return self.counts[RP] + self.counts[RK]
+        return self.counts[BP] + self.counts[BK]
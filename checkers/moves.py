@@ -7,8 +7,8 @@ This file holds all objects relating to the moves possible in the game.
 #===============================================================================
 
 from .consts import (RED_PLAYER, BLACK_PLAYER, 
-                     BOARD_ROWS, BOARD_COLS, 
-                     IS_BLACK_TILE, 
+                     BOARD_ROWS, BOARD_COLS, BACK_ROW,
+                     IS_BLACK_TILE, SQUARE_INDEX, PLAYABLE_SQUARES,
                      RP, RK, BP, BK)
 
 #===============================================================================
@@ -16,6 +16,16 @@ from .consts import (RED_PLAYER, BLACK_PLAYER,
 #===============================================================================
 
 class GameMove:
+    """A move of a tool. Moves are not changed after they are built, so the same object can be shared (the single
+    moves are, see single_move).
+
+    Every move carries its code: bits 0-4 hold the origin square number (see PLAYABLE_SQUARES),
+    bits 5-9 the target square number and the bits from 10 on the mask of the jumped squares.
+    Two moves of the same state with equal codes lead to the same state, and moves are equal and
+    hashed by their code, so tables can be keyed by the code instead of the move.
+    """
+    __slots__ = ('player_type', 'origin_loc', 'target_loc', 'jumped_locs', 'code')
+
     def __init__(self, player_type, origin_loc, target_loc, jumped_locs = None):
         """
         :param: player_type of the tool moved, could be RP, RK, BP, BK
@@ -23,12 +33,43 @@ class GameMove:
         :param: target_loc a 2-tuple defining the location on the board we would like
             to move the tool to. In multiple jumps this is the final destination.
         :param: jumped_locs is a list of tools we jumped during our move. If this
-            is None or an empty list, this is an ordinary move and not a jump
+            is None or an empty list, this is an ordinary move and not a jump.
+            It is kept as a tuple, since moves are shared (see single_move).
         """
         self.player_type = player_type
         self.origin_loc = origin_loc
         self.target_loc = target_loc
-        self.jumped_locs = jumped_locs if jumped_locs is not None else []
+        self.jumped_locs = tuple(jumped_locs) if jumped_locs is not None else ()
+        code = SQUARE_INDEX[origin_loc] | (SQUARE_INDEX[target_loc] << 5)
+        for loc in self.jumped_locs:
+            code |= 1 << (SQUARE_INDEX[loc] + 10)
+        self.code = code
+
+    @classmethod
+    def from_squares(cls, player_type, origin, target, jumped=()):
+        """Builds a move from square numbers, without looking up the locations.
+        :param: origin, target the origin and target square numbers
+        :param: jumped the square numbers of the jumped tools, in the order they are jumped
+        """
+        move = cls.__new__(cls)
+        move.player_type = player_type
+        move.origin_loc = PLAYABLE_SQUARES[origin]
+        move.target_loc = PLAYABLE_SQUARES[target]
+        move.jumped_locs = tuple(PLAYABLE_SQUARES[n] for n in jumped)
+        code = origin | (target << 5)
+        for n in jumped:
+            code |= 1 << (n + 10)
+        move.code = code
+        return move
+
+    def __eq__(self, other):
+        return isinstance(other, GameMove) and self.code == other.code
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self.code
         
     def __str__(self):
         s = " ".join(["Move", self.player_type,
@@ -38,7 +79,18 @@ class GameMove:
             s += ", eat: " + ",".join([str(loc) for loc in self.jumped_locs])
         
         return s
-        
+
+
+def encode_move(move):
+    """Encodes a move as an int, so it can be stored compactly (e.g. in a transposition table).
+    This is the move's code, see GameMove.
+    """
+    return move.code
+
+
+# The bits of a move code holding its origin and target. For a single move this is the whole code.
+ORIGIN_TARGET_MASK = (1 << 10) - 1
+
 #===============================================================================
 # Move Constants
 #===============================================================================
@@ -135,3 +187,116 @@ TOOL_CAPTURE_MOVES = {
     BP : UP_CAPTURE_MOVES,
     BK : KING_CAPTURE_MOVES,
 }
+
+#===============================================================================
+# Square Number Tables
+#===============================================================================
+
+# The same moves, indexed by the square number (see PLAYABLE_SQUARES) instead of the
+# (row, col) location, so a move generator working on square numbers does not hash
+# tuples. The moves of every square are in the same order as in the tables above.
+
+def loc_to_square(loc):
+    """
+    :return: The square number of a (row, col) location of a playable square.
+    """
+    return SQUARE_INDEX[loc]
+
+
+def square_to_loc(square):
+    """
+    :return: The (row, col) location of a square number.
+    """
+    return PLAYABLE_SQUARES[square]
+
+
+def _square_single_moves(single_moves):
+    """Converts a location:list of locations dict to a tuple, indexed by the square number, of tuples of the target
+    square numbers.
+    """
+    return tuple(tuple(SQUARE_INDEX[target] for target in single_moves[loc])
+                 for loc in PLAYABLE_SQUARES)
+
+
+def _square_capture_moves(capture_moves):
+    """Converts a location:list of (jumped, target) dict to a tuple, indexed by the square number, of tuples of
+    (jumped square number, target square number).
+    """
+    return tuple(tuple((SQUARE_INDEX[jumped], SQUARE_INDEX[target]) for jumped, target in capture_moves[loc])
+                 for loc in PLAYABLE_SQUARES)
+
+
+UP_SINGLE_SQUARES = _square_single_moves(UP_SINGLE_MOVES)
+DOWN_SINGLE_SQUARES = _square_single_moves(DOWN_SINGLE_MOVES)
+KING_SINGLE_SQUARES = _square_single_moves(KING_SINGLE_MOVES)
+UP_JUMP_SQUARES = _square_capture_moves(UP_CAPTURE_MOVES)
+DOWN_JUMP_SQUARES = _square_capture_moves(DOWN_CAPTURE_MOVES)
+KING_JUMP_SQUARES = _square_capture_moves(KING_CAPTURE_MOVES)
+
+PAWN_SINGLE_SQUARES = {
+    RED_PLAYER: DOWN_SINGLE_SQUARES,
+    BLACK_PLAYER: UP_SINGLE_SQUARES,
+}
+
+PAWN_JUMP_SQUARES = {
+    RED_PLAYER: DOWN_JUMP_SQUARES,
+    BLACK_PLAYER: UP_JUMP_SQUARES,
+}
+
+TOOL_SINGLE_SQUARES = {
+    RP: DOWN_SINGLE_SQUARES,
+    RK: KING_SINGLE_SQUARES,
+    BP: UP_SINGLE_SQUARES,
+    BK: KING_SINGLE_SQUARES,
+}
+
+TOOL_JUMP_SQUARES = {
+    RP: DOWN_JUMP_SQUARES,
+    RK: KING_JUMP_SQUARES,
+    BP: UP_JUMP_SQUARES,
+    BK: KING_JUMP_SQUARES,
+}
+
+# PROMOTION_SQUARES[player][n] tells whether a pawn of the player becomes a king on square number n.
+PROMOTION_SQUARES = {
+    player: tuple(loc[0] == BACK_ROW[player] for loc in PLAYABLE_SQUARES)
+    for player in (RED_PLAYER, BLACK_PLAYER)
+}
+
+#===============================================================================
+# Interned Single Moves
+#===============================================================================
+
+# The single moves of every tool, built once and shared by all the states:
+# SINGLE_MOVE_TABLE[tool][n] is a tuple of (target square number, GameMove) pairs
+# of the moves from square number n, in the order of TOOL_SINGLE_SQUARES.
+SINGLE_MOVE_TABLE = {
+    tool: tuple(tuple((target, GameMove.from_squares(tool, origin, target)) for target in targets)
+                for origin, targets in enumerate(TOOL_SINGLE_SQUARES[tool]))
+    for tool in (RP, RK, BP, BK)
+}
+
+# tool -> move code -> the single move.
+_SINGLE_MOVES_BY_CODE = {
+    tool: {move.code: move for moves in table for _, move in moves}
+    for tool, table in SINGLE_MOVE_TABLE.items()
+}
+
+
+def single_move(player_type, origin, target):
+    """
+    :param: player_type the moved tool
+    :param: origin, target square numbers of a single move of this tool
+    :return: The shared GameMove of the single move.
+    """
+    return _SINGLE_MOVES_BY_CODE[player_type][origin | (target << 5)]
+
+
+def single_move_of_code(player_type, code):
+    """
+    :param: player_type the moved tool
+    :param: code a move code
+    :return: The shared GameMove of the single move of this tool with the given code, or None if the tool has no
+        such single move.
+    """
+    return _SINGLE_MOVES_BY_CODE[player_type].get(code)
@@ -0,0 +1,115 @@
+"""Opening books: the moves to play in the positions of the first plies of the game.
+
+A book is a file of fixed size records (position key, move code, weight), sorted by the Zobrist key of the position
+(GameState.key) and by move. A position may have several moves, played in proportion to their weights. The file is
+memory mapped and searched by bisection, so probing does not load it.
+
+Books are built by build_opening_book.py.
+"""
+from __future__ import print_function, division
+import os
+import mmap
+import struct
+import random
+from .moves import encode_move
+
+#===============================================================================
+# Constants
+#===============================================================================
+
+BOOK_MAGIC = b'CKOB'
+BOOK_VERSION = 1
+# Magic, version and number of records.
+BOOK_HEADER = struct.Struct('<4sII')
+# Position key, move code (see encode_move) and weight.
+BOOK_RECORD = struct.Struct('<QQI')
+
+#===============================================================================
+# Files
+#===============================================================================
+
+def write_book(path, entries):
+    """Writes a book file. The file is written under a temporary name and renamed, so a file that exists is always
+    complete.
+
+    :param path: The path of the file.
+    :param entries: A position key -> list of (move code, weight) dictionary.
+    """
+    records = sorted((key, move_code, weight) for key, moves in entries.items() for move_code, weight in moves)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as book_file:
+        book_file.write(BOOK_HEADER.pack(BOOK_MAGIC, BOOK_VERSION, len(records)))
+        for record in records:
+            book_file.write(BOOK_RECORD.pack(*record))
+    os.replace(temp_path, path)
+
+
+class OpeningBook:
+    """Reads the moves of positions from a memory mapped book file.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the book file.
+        :raises ValueError: If it is not a book file.
+        """
+        with open(path, 'rb') as book_file:
+            magic, version, self.size = BOOK_HEADER.unpack(book_file.read(BOOK_HEADER.size))
+            if magic != BOOK_MAGIC or version != BOOK_VERSION:
+                raise ValueError('{} is not an opening book file of version {}'.format(path, BOOK_VERSION))
+            self.data = mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # The probes, and the ones that found the position.
+        self.probes = 0
+        self.hits = 0
+
+    def _record(self, i):
+        return BOOK_RECORD.unpack_from(self.data, BOOK_HEADER.size + i * BOOK_RECORD.size)
+
+    def probe(self, key):
+        """
+        :param key: The key of a position.
+        :return: The list of the (move code, weight) of the position, empty if it is not in the book.
+        """
+        self.probes += 1
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        moves = []
+        while low < self.size:
+            record_key, move_code, weight = self._record(low)
+            if record_key != key:
+                break
+            moves.append((move_code, weight))
+            low += 1
+        if moves:
+            self.hits += 1
+        return moves
+
+    def choose_move(self, state, possible_moves, rng=random):
+        """
+        :param state: The current state.
+        :param possible_moves: Its possible moves.
+        :param rng: The random source choosing between the book moves.
+        :return: One of the possible moves that the book has for the state, chosen in proportion to the weights, or
+                 None.
+        """
+        weights = dict(self.probe(state.key))
+        candidates = [move for move in possible_moves if weights.get(encode_move(move), 0) > 0]
+        if not candidates:
+            return None
+        total = sum(weights[encode_move(move)] for move in candidates)
+        pick = rng.random() * total
+        for move in candidates:
+            pick -= weights[encode_move(move)]
+            if pick < 0:
+                return move
+        return candidates[-1]
+
+    def close(self):
+        self.data.close()
@@ -0,0 +1,537 @@
+"""Endgame tablebases: the exact result of every position with few pieces, solved by retrograde analysis.
+
+Positions are grouped in slices by their material: (red pawns, red kings, black pawns, black kings). A slice is
+stored in its own file, holding one entry per index of the slice. The index of a position is computed directly from
+the bitboards of its pieces (see position_index), so a result is read without searching the file. Only the legal
+placements of the pieces are indexed.
+
+The results are from the point of view of the player to move, with the distance (in plies) to the end of the game
+when the tables are built with distances:
+- DRAW: neither side can force a win.
+- WIN in d: the player to move wins within d plies.
+- LOSS in d: the player to move loses in d plies, at best.
+Draws by MAX_TURNS_NO_JUMP are not part of the analysis: the turns since the last jump are taken as 0.
+
+The tables are built by build_tablebase.py, and read during the search by TablebaseProber.
+"""
+from __future__ import print_function, division
+import os
+import mmap
+import struct
+import itertools
+from math import factorial
+from .consts import *
+from .board import GameState, EM_CODE
+
+#===============================================================================
+# Constants
+#===============================================================================
+
+# The results.
+DRAW = 0
+WIN = 1
+LOSS = 2
+
+# File formats: one byte per position holding the result and its distance, or 2 bits per position with the result
+# only.
+FORMAT_DTW = 0
+FORMAT_WDL = 1
+
+# The distances stored are capped to fit in a byte.
+MAX_DISTANCE = 127
+
+TABLE_MAGIC = b'CKTB'
+TABLE_VERSION = 3
+# Magic, version, format, the piece counts of the slice, and the longest distance of a win or a loss in the slice.
+TABLE_HEADER = struct.Struct('<4sBB4BB')
+
+TABLE_SUFFIX = '.tb'
+
+# The tools in the order their squares are indexed.
+SLICE_TOOLS = (RP, RK, BP, BK)
+
+# The squares each tool may stand on: a pawn on its promotion row is a king.
+ALLOWED_SQUARES = {
+    RP: [n for n, loc in enumerate(PLAYABLE_SQUARES) if loc[0] != BACK_ROW[RED_PLAYER]],
+    BP: [n for n, loc in enumerate(PLAYABLE_SQUARES) if loc[0] != BACK_ROW[BLACK_PLAYER]],
+    RK: list(range(NUM_SQUARES)),
+    BK: list(range(NUM_SQUARES)),
+}
+
+
+def _binomial(n, k):
+    if k > n:
+        return 0
+    return factorial(n) // (factorial(k) * factorial(n - k))
+
+
+BINOMIAL = [[_binomial(n, k) for k in range(NUM_SQUARES + 1)] for n in range(NUM_SQUARES + 1)]
+
+# The bit of every square in a bitboard.
+SQUARE_BITS = [1 << n for n in range(NUM_SQUARES)]
+ALL_SQUARES = (1 << NUM_SQUARES) - 1
+
+
+def _squares_bitboard(squares):
+    bb = 0
+    for n in squares:
+        bb |= SQUARE_BITS[n]
+    return bb
+
+
+# The squares a pawn of both colors may stand on, the ones only a red pawn may stand on, and the ones a black pawn may
+# stand on.
+SHARED_PAWN_SQUARES = _squares_bitboard(ALLOWED_SQUARES[RP]) & _squares_bitboard(ALLOWED_SQUARES[BP])
+RED_PAWN_ONLY_SQUARES = _squares_bitboard(ALLOWED_SQUARES[RP]) & ~SHARED_PAWN_SQUARES
+BLACK_PAWN_SQUARES = _squares_bitboard(ALLOWED_SQUARES[BP])
+
+#===============================================================================
+# Indexing
+#===============================================================================
+
+def iter_bits(bb):
+    """Yields the square numbers of the set bits of the given bitboard, lowest first.
+    """
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def state_pieces(state):
+    """
+    :param state: A checkers.board.GameState.
+    :return: The tool -> bitboard dictionary of the pieces of the state (see GameState.encode).
+    """
+    return dict(zip(SLICE_TOOLS, state.encode()[:4]))
+
+
+def slice_material(pieces):
+    """
+    :param pieces: A tool -> bitboard dictionary (see state_pieces).
+    :return: The material of the position: the (red pawns, red kings, black pawns, black kings) counts.
+    """
+    return tuple(bin(pieces[tool]).count('1') for tool in SLICE_TOOLS)
+
+
+def count_squares(bb):
+    return bin(bb).count('1')
+
+
+def pawn_groups(material):
+    """The placements of the pawns of a slice are indexed in groups, by the number of red pawns on squares a black
+    pawn may stand on: the black pawns are placed on the BLACK_PAWN_SQUARES left by the red pawns, whose number only
+    depends on that group.
+
+    :return: A list of tuples, one for every group: (The number of red pawns on SHARED_PAWN_SQUARES, the number of
+             placements of the red pawns, the number of placements of the black pawns for each of them).
+    """
+    rp_count, _, bp_count, _ = material
+    shared_squares = count_squares(SHARED_PAWN_SQUARES)
+    red_only_squares = count_squares(RED_PAWN_ONLY_SQUARES)
+    groups = []
+    for shared_count in range(max(0, rp_count - red_only_squares), min(rp_count, shared_squares) + 1):
+        groups.append((shared_count,
+                       BINOMIAL[shared_squares][shared_count] * BINOMIAL[red_only_squares][rp_count - shared_count],
+                       BINOMIAL[count_squares(BLACK_PAWN_SQUARES) - shared_count][bp_count]))
+    return groups
+
+
+def slice_size(material):
+    """
+    :return: The number of indexes of the slice: every legal placement of the pieces (on distinct squares, and the
+             pawns on their ALLOWED_SQUARES), for each player to move.
+    """
+    rp_count, rk_count, bp_count, bk_count = material
+    pawn_placements = sum(rp_placements * bp_placements for _, rp_placements, bp_placements in pawn_groups(material))
+    free_squares = NUM_SQUARES - rp_count - bp_count
+    return 2 * pawn_placements * BINOMIAL[free_squares][rk_count] * BINOMIAL[free_squares - rk_count][bk_count]
+
+
+def rank_squares(bb, available=ALL_SQUARES):
+    """
+    :param bb: A set of squares, all of them available.
+    :param available: The bitboard of the squares the set is chosen from.
+    :return: The rank of the set among the sets of the same size of the available squares (the combinatorial number
+             system, on the squares numbered by their order among the available squares).
+    """
+    rank = 0
+    for i, n in enumerate(iter_bits(bb)):
+        rank += BINOMIAL[count_squares(available & (SQUARE_BITS[n] - 1))][i + 1]
+    return rank
+
+
+def position_index(pieces, curr_player, material):
+    """The pawns are indexed first (see pawn_groups), then the red kings on the squares left free, and the black kings
+    on the squares left after them.
+
+    :param pieces: A tool -> bitboard dictionary.
+    :param curr_player: The player to move.
+    :param material: The slice_material of the position.
+    :return: The index of the position in its slice.
+    """
+    rp_count, rk_count, bp_count, bk_count = material
+    red_pawns, black_pawns = pieces[RP], pieces[BP]
+    shared_red_pawns = red_pawns & SHARED_PAWN_SQUARES
+    shared_count = count_squares(shared_red_pawns)
+
+    index = 0
+    for group_count, rp_placements, bp_placements in pawn_groups(material):
+        if group_count == shared_count:
+            break
+        index += rp_placements * bp_placements
+    red_pawns_rank = (rank_squares(shared_red_pawns, SHARED_PAWN_SQUARES)
+                      * BINOMIAL[count_squares(RED_PAWN_ONLY_SQUARES)][rp_count - shared_count]
+                      + rank_squares(red_pawns & RED_PAWN_ONLY_SQUARES, RED_PAWN_ONLY_SQUARES))
+    index += (red_pawns_rank * bp_placements
+              + rank_squares(black_pawns, BLACK_PAWN_SQUARES & ~red_pawns))
+
+    free = ALL_SQUARES & ~(red_pawns | black_pawns)
+    free_squares = NUM_SQUARES - rp_count - bp_count
+    index = index * BINOMIAL[free_squares][rk_count] + rank_squares(pieces[RK], free)
+    free &= ~pieces[RK]
+    index = index * BINOMIAL[free_squares - rk_count][bk_count] + rank_squares(pieces[BK], free)
+    return index * 2 + (curr_player == BLACK_PLAYER)
+
+
+def slice_positions(material):
+    """Yields all the positions of a slice as (red pawns, red kings, black pawns, black kings) bitboard tuples.
+    """
+    def placements(tool, count, occupied):
+        for squares in itertools.combinations(ALLOWED_SQUARES[tool], count):
+            bb = 0
+            for n in squares:
+                bb |= SQUARE_BITS[n]
+            if not bb & occupied:
+                yield bb
+
+    rp_count, rk_count, bp_count, bk_count = material
+    for rp in placements(RP, rp_count, 0):
+        for rk in placements(RK, rk_count, rp):
+            for bp in placements(BP, bp_count, rp | rk):
+                for bk in placements(BK, bk_count, rp | rk | bp):
+                    yield rp, rk, bp, bk
+
+
+def slice_name(material):
+    """
+    :return: The file name of the slice, e.g. '0-2-1-0.tb' for two red kings against a black pawn.
+    """
+    return '-'.join(str(count) for count in material) + TABLE_SUFFIX
+
+
+def all_slices(max_pieces):
+    """
+    :return: The material of every slice with both players on board and up to max_pieces pieces, in an order where
+             every slice comes after the slices its moves lead to: fewer pieces (captures) and fewer pawns
+             (promotions) first.
+    """
+    slices = []
+    for total in range(2, max_pieces + 1):
+        for material in itertools.product(range(total + 1), repeat=4):
+            rp, rk, bp, bk = material
+            if sum(material) == total and rp + rk > 0 and bp + bk > 0:
+                slices.append(material)
+    return sorted(slices, key=lambda material: (sum(material), material[0] + material[2], material))
+
+
+def slice_level(material):
+    """
+    :return: The slices of the same level do not depend on each other, and can be solved in parallel.
+    """
+    return sum(material), material[0] + material[2]
+
+#===============================================================================
+# Values
+#===============================================================================
+
+def encode_value(result, distance=0):
+    """
+    :return: The one byte entry of a result: 0 for a draw, 1..127 for a win, 128..255 for a loss.
+    """
+    if result == WIN:
+        return min(distance, MAX_DISTANCE - 1) + 1
+    if result == LOSS:
+        return 0x80 | min(distance, MAX_DISTANCE)
+    return 0
+
+
+def decode_value(entry):
+    """
+    :return: The (result, distance) of a one byte entry.
+    """
+    if entry == 0:
+        return DRAW, 0
+    if entry & 0x80:
+        return LOSS, entry & 0x7f
+    return WIN, entry - 1
+
+
+def wdl_entry(data, index):
+    """
+    :return: The result stored at the index of the 2 bit per position data.
+    """
+    return (data[index >> 2] >> ((index & 3) << 1)) & 3
+
+#===============================================================================
+# Files
+#===============================================================================
+
+def write_table(path, material, values, table_format=FORMAT_DTW):
+    """Writes a slice file. The file is written under a temporary name and renamed, so a file that exists is always
+    complete.
+
+    :param path: The path of the file.
+    :param material: The material of the slice.
+    :param values: A bytearray of the one byte entries of the slice, one per index.
+    :param table_format: FORMAT_DTW or FORMAT_WDL.
+    """
+    longest_distance = max([decode_value(entry)[1] for entry in values if entry] or [0])
+    if table_format == FORMAT_WDL:
+        data = bytearray((len(values) + 3) // 4)
+        for index, entry in enumerate(values):
+            if entry:
+                data[index >> 2] |= decode_value(entry)[0] << ((index & 3) << 1)
+    else:
+        data = values
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as table_file:
+        table_file.write(TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, table_format, *material, longest_distance))
+        table_file.write(data)
+    os.replace(temp_path, path)
+
+
+def read_header(header, path):
+    """
+    :return: The (format, material, longest distance) of the slice file with the given header.
+    :raises ValueError: If it is not a tablebase file.
+    """
+    magic, version, table_format, *material, longest_distance = TABLE_HEADER.unpack(header)
+    if magic != TABLE_MAGIC or version != TABLE_VERSION:
+        raise ValueError('{} is not a tablebase file of version {}'.format(path, TABLE_VERSION))
+    return table_format, tuple(material), longest_distance
+
+
+def read_table(path):
+    """
+    :return: The one byte entries of a slice file (see write_table), whatever its format.
+    """
+    with open(path, 'rb') as table_file:
+        table_format, material, _ = read_header(table_file.read(TABLE_HEADER.size), path)
+        data = table_file.read()
+    if table_format == FORMAT_DTW:
+        return bytearray(data)
+
+    values = bytearray(slice_size(material))
+    for index in range(len(values)):
+        result = wdl_entry(data, index)
+        if result != DRAW:
+            values[index] = encode_value(result)
+    return values
+
+#===============================================================================
+# Retrograde analysis
+#===============================================================================
+
+def solve_slice(material, dependencies):
+    """Solves all the positions of a slice.
+
+    The moves of every position are generated once (with the rules of checkers.board.GameState). Moves that stay in
+    the slice become edges, and moves leaving it (captures and promotions) are looked up in the dependencies. Then the
+    results are propagated backwards from the decided positions, by increasing distance: a position is a win as soon
+    as one of its moves leads to a loss, and a loss once all of its moves lead to wins. What is left is a draw.
+
+    :param material: The material of the slice.
+    :param dependencies: A material -> entries dictionary of the slices the moves of this slice lead to.
+    :return: A bytearray of the one byte entries (see encode_value) of the slice.
+    """
+    ids = {}
+    predecessors = []
+    unresolved = []
+    win_distance = []
+    loss_distance = []
+    has_draw = []
+    buckets = [[]]
+
+    def push(distance, position_id, result):
+        while len(buckets) <= distance:
+            buckets.append([])
+        buckets[distance].append((position_id, result))
+
+    positions = [(bitboards, player) for bitboards in slice_positions(material)
+                 for player in (RED_PLAYER, BLACK_PLAYER)]
+    indexes = []
+    for position_id, (bitboards, player) in enumerate(positions):
+        indexes.append(position_index(dict(zip(SLICE_TOOLS, bitboards)), player, material))
+        ids[indexes[-1]] = position_id
+        predecessors.append([])
+        unresolved.append(0)
+        win_distance.append(None)
+        loss_distance.append(0)
+        has_draw.append(False)
+
+    for position_id, (bitboards, player) in enumerate(positions):
+        state = GameState.decode(bitboards + (player, 0))
+        moves = state.get_possible_moves()
+        if not moves:
+            # This player has no moves. So the previous player is the winner.
+            push(0, position_id, LOSS)
+            continue
+
+        for move in moves:
+            undo = state.make_move(move)
+            child_pieces = state_pieces(state)
+            child_material = slice_material(child_pieces)
+            if child_material == material:
+                child_id = ids[position_index(child_pieces, state.curr_player, material)]
+                predecessors[child_id].append(position_id)
+                unresolved[position_id] += 1
+            else:
+                if child_material[0] + child_material[1] == 0 or child_material[2] + child_material[3] == 0:
+                    # The player to move in the child has no pieces left.
+                    result, distance = LOSS, 0
+                else:
+                    child_index = position_index(child_pieces, state.curr_player, child_material)
+                    result, distance = decode_value(dependencies[child_material][child_index])
+                if result == LOSS:
+                    if win_distance[position_id] is None or distance + 1 < win_distance[position_id]:
+                        win_distance[position_id] = distance + 1
+                elif result == WIN:
+                    loss_distance[position_id] = max(loss_distance[position_id], distance + 1)
+                else:
+                    has_draw[position_id] = True
+            state.unmake_move(undo)
+
+        if win_distance[position_id] is not None:
+            push(win_distance[position_id], position_id, WIN)
+        elif unresolved[position_id] == 0 and not has_draw[position_id]:
+            push(loss_distance[position_id], position_id, LOSS)
+
+    values = bytearray(slice_size(material))
+    resolved = [False] * len(positions)
+    distance = 0
+    while distance < len(buckets):
+        for position_id, result in buckets[distance]:
+            if resolved[position_id]:
+                continue
+            resolved[position_id] = True
+            values[indexes[position_id]] = encode_value(result, distance)
+
+            for predecessor in predecessors[position_id]:
+                if resolved[predecessor]:
+                    continue
+                unresolved[predecessor] -= 1
+                if result == LOSS:
+                    # The predecessor moves into a loss of its opponent.
+                    if win_distance[predecessor] is None or distance + 1 < win_distance[predecessor]:
+                        win_distance[predecessor] = distance + 1
+                        push(distance + 1, predecessor, WIN)
+                else:
+                    loss_distance[predecessor] = max(loss_distance[predecessor], distance + 1)
+                    if (unresolved[predecessor] == 0 and win_distance[predecessor] is None
+                            and not has_draw[predecessor]):
+                        push(loss_distance[predecessor], predecessor, LOSS)
+        distance += 1
+
+    return values
+
+
+def dependency_slices(material):
+    """
+    :return: The materials of the other slices the moves of the slice can lead to, with both players on board.
+    """
+    dependencies = []
+    for other in all_slices(sum(material)):
+        if other == material:
+            continue
+        rp, rk, bp, bk = other
+        # Pawns are captured or promoted, and kings are captured or come from promoted pawns.
+        if (rp <= material[0] and rp + rk <= material[0] + material[1] and bp <= material[2]
+                and bp + bk <= material[2] + material[3] and slice_level(other) < slice_level(material)):
+            dependencies.append(other)
+    return dependencies
+
+
+#===============================================================================
+# Probing
+#===============================================================================
+
+class TablebaseProber:
+    """Reads the results of positions from the slice files of a directory.
+
+    The files are memory mapped read-only: nothing is loaded up front, a probe only touches the page of its entry,
+    and all the processes probing the same files share their pages in the OS page cache.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: The directory of the slice files (see build_tablebase.py).
+        """
+        # material -> (format, memory map, longest distance)
+        self.tables = {}
+        for name in os.listdir(directory):
+            if not name.endswith(TABLE_SUFFIX):
+                continue
+            path = os.path.join(directory, name)
+            with open(path, 'rb') as table_file:
+                table_format, material, longest_distance = read_header(table_file.read(TABLE_HEADER.size), path)
+                self.tables[material] = (table_format, mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ),
+                                         longest_distance)
+        self.max_pieces = max([sum(material) for material in self.tables] or [0])
+
+        # The probes of positions with at most max_pieces pieces, and the ones that found a result.
+        self.probes = 0
+        self.hits = 0
+
+    def state_pieces(self, state):
+        """
+        :return: The tool -> bitboard dictionary of the state, or None if it has more than max_pieces pieces.
+        """
+        if NUM_SQUARES - state.cells.count(EM_CODE) > self.max_pieces:
+            return None
+        return state_pieces(state)
+
+    def probe(self, state):
+        """Reads the result of a position. Wins and losses that may not end before the game is drawn by
+        MAX_TURNS_NO_JUMP are not exact, and are not returned: in a table without distances, that is all of them once
+        the longest one of the slice does not fit in the plies left.
+
+        :param state: A checkers.board.GameState.
+        :return: A tuple: (The result for the player to move, the distance in plies or None if the table has no
+                 distances), or None if the position is not in the tables.
+        """
+        pieces = self.state_pieces(state)
+        if pieces is None:
+            return None
+        self.probes += 1
+        material = slice_material(pieces)
+        if material[0] + material[1] == 0 or material[2] + material[3] == 0:
+            return None
+        table = self.tables.get(material)
+        if table is None:
+            return None
+
+        table_format, data, longest_distance = table
+        index = position_index(pieces, state.curr_player, material)
+        # The game is drawn as soon as the move reaching this many plies without a jump is played.
+        plies_left = 2 * (MAX_TURNS_NO_JUMP - state.turns_since_last_jump)
+        if table_format == FORMAT_DTW:
+            result, distance = decode_value(data[TABLE_HEADER.size + index])
+            if result != DRAW and distance >= plies_left:
+                return None
+        else:
+            result = (data[TABLE_HEADER.size + (index >> 2)] >> ((index & 3) << 1)) & 3
+            if result != DRAW and longest_distance >= plies_left:
+                return None
+            distance = None if result != DRAW else 0
+        self.hits += 1
+        return result, distance
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0
+
+    def close(self):
+        for _, data, _ in self.tables.values():
+            data.close()
+        self.tables = {}
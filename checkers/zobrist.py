@@ -0,0 +1,48 @@
+"""
+Zobrist hashing of game states.
+
+A position's key is the XOR of one random 64 bit number per (tool, square) on the
+board, XORed with BLACK_TO_MOVE_KEY when it is black's turn. Performing a move only
+changes a few terms, so the game states keep their key up to date incrementally.
+"""
+
+#===============================================================================
+# Imports
+#===============================================================================
+
+import random
+from .consts import (RP, RK, BP, BK, EM, BLACK_PLAYER,
+                     PLAYABLE_SQUARES, NUM_SQUARES)
+
+#===============================================================================
+# Keys
+#===============================================================================
+
+# A fixed seed keeps the keys identical between runs and between processes, so
+# keys can be stored in files or shared by several searches.
+_random = random.Random(0x5EED)
+
+# ZOBRIST_SQUARE_KEYS[tool][n] is the key of a tool standing on square number n.
+ZOBRIST_SQUARE_KEYS = {tool: [_random.getrandbits(64) for _ in range(NUM_SQUARES)]
+                       for tool in (RP, RK, BP, BK)}
+
+# The same keys, indexed by (row, col) locations.
+ZOBRIST_KEYS = {tool: {loc: keys[n] for n, loc in enumerate(PLAYABLE_SQUARES)}
+                for tool, keys in ZOBRIST_SQUARE_KEYS.items()}
+
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)
+
+
+def compute_key(board, curr_player):
+    """Computes the key of a position from scratch.
+
+    :param board: A (row, col) -> tool dictionary, as GameState.board.
+    :param curr_player: The player whose turn it is.
+    :return: The 64 bit Zobrist key.
+    """
+    key = BLACK_TO_MOVE_KEY if curr_player == BLACK_PLAYER else 0
+    for loc in PLAYABLE_SQUARES:
+        tool = board[loc]
+        if tool != EM:
+            key ^= ZOBRIST_KEYS[tool][loc]
+    return key
@@ -0,0 +1,550 @@
+"""Parallel search across worker processes.
+"""
+import os
+import sys
+import time
+import weakref
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from checkers.board import GameState
+from checkers.moves import encode_move
+from utils import INFINITY, Deadline, MoveOrdering
+
+# Size of a shared transposition table entry, in 64 bit words: the checked key, the move code, the value and the
+# packed depth, bound and search id.
+SHARED_TT_ENTRY_WORDS = 4
+# The table starts with a header word holding the current search id, padded to an entry.
+SHARED_TT_HEADER_WORDS = SHARED_TT_ENTRY_WORDS
+
+# How often (in seconds) the parent checks for cancellation while waiting for the workers.
+RESULT_POLL_INTERVAL = 0.01
+
+# The number of cancellation checks of a worker's search between two reads of the shared search id.
+WORKER_CANCELLATION_POLLS = 256
+
+# The niceness of the ponder process. Its search runs during the opponent's turn, so it should only get the CPU time
+# the opponent leaves idle.
+PONDER_NICENESS = 19
+# How long (in seconds) the player waits for the result of a ponder hit once the ponder search is stopped.
+PONDER_STOP_TIMEOUT = 0.5
+
+# Whether this process is a worker, and its player, set by the _init_*_worker functions.
+_in_worker = False
+_worker_player = None
+# [search id, alpha] of the root search currently running, shared by all the root split workers.
+_worker_shared_bound = None
+# The id of the search the workers should run. The parent changes it to cancel the tasks of a search.
+_worker_shared_search_id = None
+
+
+def in_worker_process():
+    """
+    :return: Whether this is a worker process of a parallel search. Players built in a worker must not start workers
+             of their own.
+    """
+    return _in_worker
+
+
+def _init_root_split_worker(player_module, player_args, shared_bound, shared_search_id):
+    """Initializes a worker process: builds its own instance of the player, that runs the searches of the worker.
+    The worker's deadline is measured on the wall clock, which is shared with the parent, and not on the process CPU
+    time.
+    """
+    global _in_worker, _worker_player, _worker_shared_bound, _worker_shared_search_id
+    _in_worker = True
+    __import__(player_module)
+    _worker_player = sys.modules[player_module].Player(*player_args)
+    _worker_player.deadline = Deadline(time.monotonic)
+    _worker_shared_bound = shared_bound
+    _worker_shared_search_id = shared_search_id
+
+
+def _search_root_move(search_id, encoded_state, move_code, depth, end_time):
+    """Searches one root move in a worker process.
+
+    :param search_id: The id of the root search this move belongs to.
+    :param encoded_state: The root state, as GameState.encode.
+    :param move_code: The root move to search, as encode_move.
+    :param depth: The depth of the root search.
+    :param end_time: The time.monotonic() time the search must end by.
+    :return: A tuple: (move_code, the move's value, whether the search of the move completed).
+    """
+    # The task of a search the parent has already given up on is dropped.
+    if _worker_shared_search_id.value != search_id:
+        return move_code, -INFINITY, False
+
+    state = GameState.decode(encoded_state)
+    move = next(move for move in state.get_possible_moves() if encode_move(move) == move_code)
+    _worker_player.deadline.start(end_time - time.monotonic())
+    minimax = _worker_player.create_minimax(_WorkerCancellation(search_id))
+
+    # The best value any worker has found so far for this root is the alpha of this move's search.
+    with _worker_shared_bound.get_lock():
+        alpha = _worker_shared_bound[1] if _worker_shared_bound[0] == search_id else -INFINITY
+
+    state.make_move(move)
+    value, _ = minimax.search(state, depth - 1, alpha, INFINITY, False, 1)
+    completed = not minimax.out_of_time()
+
+    if completed:
+        with _worker_shared_bound.get_lock():
+            if _worker_shared_bound[0] == search_id and value > _worker_shared_bound[1]:
+                _worker_shared_bound[1] = value
+    return move_code, value, completed
+
+
+class RootSplitPool:
+    """A pool of worker processes that split the root moves of a player's searches between them.
+    Every worker holds its own instance of the player (built from the player's module with the same arguments), so
+    it evaluates with the same utility and keeps its own transposition table across moves and turns.
+    """
+
+    def __init__(self, player_module, player_args, processes):
+        """
+        :param player_module: The name of the module of the player, e.g. type(player).__module__.
+        :param player_args: The arguments the player was built with.
+        :param processes: The number of worker processes.
+        """
+        self.shared_bound = multiprocessing.Array('d', [0, -INFINITY])
+        # Only this process writes the search id, so it needs no lock (see _WorkerCancellation).
+        self.shared_search_id = multiprocessing.RawValue('q', 0)
+        self.pool = multiprocessing.Pool(processes, _init_root_split_worker,
+                                         (player_module, player_args, self.shared_bound, self.shared_search_id))
+        self.search_id = 0
+        # The workers would otherwise outlive the player, e.g. across the games of a tournament.
+        self._finalizer = weakref.finalize(self, self.pool.terminate)
+
+    def new_root_search(self):
+        """Starts a new root search: from now on, the workers share the alpha of this search only.
+        :return: The id of the new search.
+        """
+        with self.shared_bound.get_lock():
+            self.search_id += 1
+            self.shared_bound[0] = self.search_id
+            self.shared_bound[1] = -INFINITY
+        self.shared_search_id.value = self.search_id
+        return self.search_id
+
+    def cancel_root_search(self):
+        """Stops the current root search: the workers drop its remaining tasks and stop the running ones, so they are
+        free for the next search.
+        """
+        self.search_id += 1
+        self.shared_search_id.value = self.search_id
+
+    def close(self):
+        self._finalizer()
+
+
+class ParallelRootSearch:
+    """A root-split search with the interface of MiniMaxWithAlphaBetaPruning's root search.
+    The root moves are searched in parallel by the RootSplitPool workers, the best ones of the previous iteration
+    first, and the best value found so far is shared between the workers as the alpha of the next moves.
+    The positions are sent to the workers with GameState.encode and the moves with encode_move.
+    """
+
+    def __init__(self, root_split_pool, no_more_time, time_limit, cancellation_token=None):
+        """
+        :param root_split_pool: The RootSplitPool to run the search on.
+        :param no_more_time: A function that returns true if there is no more time to run this search.
+        :param time_limit: The wall time, in seconds, the workers may search for.
+        :param cancellation_token: An optional CancellationToken, that stops the search when cancelled.
+        """
+        self.root_split_pool = root_split_pool
+        self.no_more_time = no_more_time
+        self.end_time = time.monotonic() + time_limit
+        self.cancellation_token = cancellation_token
+        # The root moves' values in the last iteration, used to order the next one.
+        self.root_values = {}
+
+    def out_of_time(self):
+        return (self.no_more_time() or time.monotonic() >= self.end_time
+                or (self.cancellation_token is not None and self.cancellation_token.cancelled))
+
+    def search(self, state, depth, alpha=-INFINITY, beta=INFINITY, maximizing_player=True):
+        """Searches the root moves in parallel. Only root (max) searches with a full window are supported.
+
+        :param state: The state to start from.
+        :param depth: The maximum allowed depth for the algorithm.
+        :return: A tuple: (The alpha-beta algorithm value, The move)
+        """
+        moves = state.get_possible_moves()
+        if not moves:
+            return -INFINITY, None
+        codes = {encode_move(move): move for move in moves}
+        ordered_codes = sorted(codes, key=lambda code: -self.root_values.get(code, -INFINITY))
+
+        search_id = self.root_split_pool.new_root_search()
+        encoded_state = state.encode()
+        pending = [self.root_split_pool.pool.apply_async(_search_root_move,
+                                                         (search_id, encoded_state, code, depth, self.end_time))
+                   for code in ordered_codes]
+
+        best_value, best_code = -INFINITY, ordered_codes[0]
+        for result in pending:
+            while True:
+                try:
+                    move_code, value, completed = result.get(RESULT_POLL_INTERVAL)
+                    break
+                except multiprocessing.TimeoutError:
+                    if self.out_of_time():
+                        self.root_split_pool.cancel_root_search()
+                        return best_value, codes[best_code]
+            if not completed:
+                self.root_split_pool.cancel_root_search()
+                return best_value, codes[best_code]
+            self.root_values[move_code] = value
+            if value > best_value:
+                best_value, best_code = value, move_code
+        return best_value, codes[best_code]
+
+    def aspiration_search(self, state, depth, guess, window=None):
+        """The root split shares the best value found so far between the workers, which plays the role of the
+        aspiration window, so this is a full window search.
+        """
+        return self.search(state, depth)
+
+
+class SharedTranspositionTable:
+    """A transposition table held in shared memory, so several processes can read and write the same entries.
+    It has the interface of utils.TranspositionTable (same entries, same two-tier replacement scheme).
+
+    The table is a flat array of 64 bit words. Entries are written without locks: the stored key is XORed with the
+    rest of the entry, so an entry torn by two concurrent writes fails the key check and is treated as missing.
+    """
+
+    def __init__(self, memory_budget=None, name=None, size=None):
+        """Creates a new table, or attaches to an existing one when name is given.
+
+        :param memory_budget: The memory of a new table, in bytes.
+        :param name: The name of the shared memory of an existing table (see the name attribute).
+        :param size: The number of buckets of the existing table (see the size attribute).
+        """
+        if name is None:
+            self.size = max(1, memory_budget // (2 * SHARED_TT_ENTRY_WORDS * 8))
+            words = SHARED_TT_HEADER_WORDS + 2 * SHARED_TT_ENTRY_WORDS * self.size
+            self.shared_memory = SharedMemory(create=True, size=words * 8)
+        else:
+            self.size = size
+            self.shared_memory = SharedMemory(name=name)
+        self.name = self.shared_memory.name
+        # Two views of the same memory: the values are doubles, everything else unsigned 64 bit words.
+        self.words = self.shared_memory.buf.cast('Q')
+        self.doubles = self.shared_memory.buf.cast('d')
+
+    @property
+    def search_id(self):
+        return self.words[0]
+
+    def new_search(self):
+        """Marks the start of a new search (a new turn), for all the processes sharing the table.
+        """
+        self.words[0] += 1
+
+    def _read(self, offset, key):
+        words = self.words
+        move_code, value_bits, meta = words[offset + 1], words[offset + 2], words[offset + 3]
+        if words[offset] ^ move_code ^ value_bits ^ meta != key:
+            return None
+        return (key, (meta & 0xffff) - 0x8000, (meta >> 16) & 0xff, self.doubles[offset + 2],
+                move_code if move_code else None, meta >> 24)
+
+    def probe(self, key):
+        """
+        :param key: The key of the position.
+        :return: The entry stored for this position, or None.
+        """
+        offset = SHARED_TT_HEADER_WORDS + 2 * SHARED_TT_ENTRY_WORDS * (key % self.size)
+        entry = self._read(offset, key)
+        if entry is None:
+            entry = self._read(offset + SHARED_TT_ENTRY_WORDS, key)
+        return entry
+
+    def store(self, key, depth, bound, value, move_code):
+        """Stores a search result.
+
+        :param key: The key of the position.
+        :param depth: The depth the position was searched to.
+        :param bound: EXACT, LOWER_BOUND or UPPER_BOUND.
+        :param value: The value found.
+        :param move_code: The encoded best move, or None.
+        """
+        offset = SHARED_TT_HEADER_WORDS + 2 * SHARED_TT_ENTRY_WORDS * (key % self.size)
+        words = self.words
+        search_id = words[0]
+        # Replace the depth-preferred entry if it is empty, of the same position, shallower or from an older search.
+        old_meta = words[offset + 3]
+        old_key = words[offset] ^ words[offset + 1] ^ words[offset + 2] ^ old_meta
+        if old_meta and old_key != key and depth < (old_meta & 0xffff) - 0x8000 and old_meta >> 24 == search_id:
+            offset += SHARED_TT_ENTRY_WORDS
+
+        move_code = move_code or 0
+        meta = (max(-0x8000, min(0x7fff, depth)) + 0x8000) | (bound << 16) | (search_id << 24)
+        self.doubles[offset + 2] = value
+        words[offset + 1] = move_code
+        words[offset + 3] = meta
+        words[offset] = key ^ move_code ^ words[offset + 2] ^ meta
+
+    def clear(self):
+        self.shared_memory.buf[SHARED_TT_HEADER_WORDS * 8:] = bytes(len(self.shared_memory.buf)
+                                                                    - SHARED_TT_HEADER_WORDS * 8)
+
+    def close(self, unlink=False):
+        """Detaches from the shared memory. The process that created the table should unlink it.
+        """
+        self.words.release()
+        self.doubles.release()
+        self.shared_memory.close()
+        if unlink:
+            self.shared_memory.unlink()
+
+
+class PerturbedMoveOrdering(MoveOrdering):
+    """The move ordering of a Lazy SMP helper: the root moves after the first one are rotated by an offset, so every
+    helper starts its iterations with a different part of the tree.
+    """
+
+    def __init__(self, root_offset):
+        MoveOrdering.__init__(self)
+        self.root_offset = root_offset
+
+    def order(self, moves, ply, tt_move_code=None):
+        ordered = MoveOrdering.order(self, moves, ply, tt_move_code)
+        if ply == 0 and len(ordered) > 2:
+            rest = ordered[1:]
+            offset = self.root_offset % len(rest)
+            ordered = ordered[:1] + rest[offset:] + rest[:offset]
+        return ordered
+
+
+class _WorkerCancellation:
+    """Cancels the search of a worker once the parent starts another search or stops the current one (see
+    RootSplitPool and LazySMPPool). The search checks it at every node, so the shared search id is only read once
+    every WORKER_CANCELLATION_POLLS checks, and once cancelled it stays cancelled.
+    """
+
+    def __init__(self, search_id):
+        self.search_id = search_id
+        self.polls_until_check = WORKER_CANCELLATION_POLLS
+        self.is_cancelled = False
+
+    @property
+    def cancelled(self):
+        if self.is_cancelled:
+            return True
+        self.polls_until_check -= 1
+        if self.polls_until_check > 0:
+            return False
+        self.polls_until_check = WORKER_CANCELLATION_POLLS
+        self.is_cancelled = _worker_shared_search_id.value != self.search_id
+        return self.is_cancelled
+
+
+def _init_lazy_smp_worker(player_module, player_args, table_name, table_size, shared_search_id):
+    """Initializes a Lazy SMP helper process: builds its own instance of the player, searching on the wall clock
+    with the shared transposition table.
+    """
+    global _in_worker, _worker_player, _worker_shared_search_id
+    _in_worker = True
+    __import__(player_module)
+    _worker_player = sys.modules[player_module].Player(*player_args)
+    _worker_player.deadline = Deadline(time.monotonic)
+    _worker_player.transposition_table = SharedTranspositionTable(name=table_name, size=table_size)
+    _worker_shared_search_id = shared_search_id
+
+
+def _lazy_smp_helper(search_id, encoded_state, helper_index, end_time):
+    """Runs iterative deepening on the root in a helper process until the end time or until the parent starts
+    another search. Every helper starts at a different depth parity and root move order, and all of them fill the
+    shared transposition table the parent's search reads.
+
+    :return: A tuple: (The deepest completed depth, its value, its encoded move) or (0, None, None).
+    """
+    state = GameState.decode(encoded_state)
+    player = _worker_player
+    player.deadline.start(end_time - time.monotonic())
+    player.move_ordering = PerturbedMoveOrdering(helper_index + 1)
+    minimax = player.create_minimax(_WorkerCancellation(search_id))
+
+    result = (0, None, None)
+    depth = 1 + helper_index % 2
+    while not minimax.out_of_time():
+        value, move = minimax.search(state, depth, -INFINITY, INFINITY, True)
+        if minimax.out_of_time() or move is None:
+            break
+        result = (depth, value, encode_move(move))
+        if abs(value) >= INFINITY:
+            break
+        depth += 1
+    return result
+
+
+class LazySMPPool:
+    """Helper processes for a Lazy SMP search of a player: while the player runs its own iterative deepening, the
+    helpers search the same root with slightly different move orders, all reading and writing one
+    SharedTranspositionTable, so the player's search finds most of its tree already searched.
+    """
+
+    def __init__(self, player_module, player_args, processes, memory_budget):
+        """
+        :param player_module: The name of the module of the player, e.g. type(player).__module__.
+        :param player_args: The arguments the player was built with.
+        :param processes: The number of helper processes.
+        :param memory_budget: The memory of the shared transposition table, in bytes.
+        """
+        self.processes = processes
+        self.table = SharedTranspositionTable(memory_budget)
+        # Only this process writes the search id, so it needs no lock, and the helpers read it without one.
+        self.shared_search_id = multiprocessing.RawValue('q', 0)
+        self.pool = multiprocessing.Pool(processes, _init_lazy_smp_worker,
+                                         (player_module, player_args, self.table.name, self.table.size,
+                                          self.shared_search_id))
+        # The shared memory outlives the processes unless unlinked, so make sure it is even if close is never called.
+        self._finalizer = weakref.finalize(self, LazySMPPool._release, self.pool, self.table)
+
+    @staticmethod
+    def _release(pool, table):
+        pool.terminate()
+        table.close(unlink=True)
+
+    def start_helpers(self, state, end_time):
+        """Stops the helpers of the previous search and starts searching the given root.
+
+        :param state: The root state.
+        :param end_time: The time.monotonic() time the helpers must stop by.
+        """
+        self.shared_search_id.value += 1
+        search_id = self.shared_search_id.value
+        encoded_state = state.encode()
+        # The helpers only fill the shared table, their results are not waited for.
+        for i in range(self.processes):
+            self.pool.apply_async(_lazy_smp_helper, (search_id, encoded_state, i, end_time))
+
+    def stop_helpers(self):
+        """Stops the helpers of the current search, e.g. once the player's own search is over, so they do not keep
+        taking the CPU from the opponent.
+        """
+        self.shared_search_id.value += 1
+
+    def close(self):
+        self._finalizer()
+
+
+class LazySMPSearch:
+    """The search of a player with Lazy SMP helpers. The first search of a move starts the helpers on its root, and
+    every search is the player's own MiniMaxWithAlphaBetaPruning on the shared transposition table.
+    """
+
+    def __init__(self, lazy_smp_pool, minimax, time_limit):
+        """
+        :param lazy_smp_pool: The LazySMPPool of the player.
+        :param minimax: The player's search, using lazy_smp_pool.table.
+        :param time_limit: The wall time, in seconds, the helpers may search for.
+        """
+        self.lazy_smp_pool = lazy_smp_pool
+        self.minimax = minimax
+        self.end_time = time.monotonic() + time_limit
+        self.root_key = None
+
+    def _start_helpers(self, state):
+        if self.root_key != state.key:
+            self.root_key = state.key
+            self.lazy_smp_pool.start_helpers(state, self.end_time)
+
+    def search(self, state, depth, alpha=-INFINITY, beta=INFINITY, maximizing_player=True):
+        self._start_helpers(state)
+        return self.minimax.search(state, depth, alpha, beta, maximizing_player)
+
+    def aspiration_search(self, state, depth, guess, window=None):
+        self._start_helpers(state)
+        if window is None:
+            return self.minimax.aspiration_search(state, depth, guess)
+        return self.minimax.aspiration_search(state, depth, guess, window)
+
+
+def _init_ponder_worker(player_module, player_args, table_name, table_size, shared_search_id):
+    """Initializes the ponder process of a player: a Lazy SMP worker (see _init_lazy_smp_worker) running at the
+    lowest priority.
+    """
+    _init_lazy_smp_worker(player_module, player_args, table_name, table_size, shared_search_id)
+    if hasattr(os, 'nice'):
+        os.nice(PONDER_NICENESS)
+
+
+def _ponder_search(search_id, encoded_state):
+    """Runs iterative deepening on the pondered position in the ponder process until the parent stops it.
+
+    :return: A tuple: (The deepest completed depth, its value, its encoded move), or None.
+    """
+    state = GameState.decode(encoded_state)
+    player = _worker_player
+    player.deadline.start(INFINITY)
+    minimax = player.create_minimax(_WorkerCancellation(search_id))
+
+    result = None
+    depth = 1
+    while True:
+        value, move = minimax.aspiration_search(state, depth, result and result[1], player.aspiration_window)
+        if minimax.out_of_time():
+            return result
+        result = (depth, value, encode_move(move))
+        if abs(value) >= INFINITY:
+            return result
+        depth += 1
+
+
+class PonderPool:
+    """A process that searches for a player during the opponent's turn (pondering). It runs at the lowest priority
+    and in its own interpreter, so it takes neither the CPU nor the GIL from the opponent's search. It holds its own
+    instance of the player, searching on a SharedTranspositionTable that the player's own searches use too.
+    """
+
+    def __init__(self, player_module, player_args, memory_budget, table=None):
+        """
+        :param player_module: The name of the module of the player, e.g. type(player).__module__.
+        :param player_args: The arguments the player was built with.
+        :param memory_budget: The memory of a new shared transposition table, in bytes.
+        :param table: The SharedTranspositionTable to search on (e.g. the one of a LazySMPPool), or None to create one.
+                      The pool only releases a table it created.
+        """
+        owns_table = table is None
+        self.table = SharedTranspositionTable(memory_budget) if owns_table else table
+        # Only this process writes the search id, so it needs no lock (see _WorkerCancellation).
+        self.shared_search_id = multiprocessing.RawValue('q', 0)
+        self.pool = multiprocessing.Pool(1, _init_ponder_worker,
+                                         (player_module, player_args, self.table.name, self.table.size,
+                                          self.shared_search_id))
+        self._finalizer = weakref.finalize(self, PonderPool._release, self.pool, self.table if owns_table else None)
+
+    @staticmethod
+    def _release(pool, table):
+        pool.terminate()
+        if table is not None:
+            table.close(unlink=True)
+
+    def start(self, state):
+        """Stops the previous ponder search and starts searching the given position.
+
+        :return: The multiprocessing.AsyncResult of the search (see stop).
+        """
+        self.shared_search_id.value += 1
+        return self.pool.apply_async(_ponder_search, (self.shared_search_id.value, state.encode()))
+
+    def stop(self, job=None):
+        """Stops the current ponder search.
+
+        :param job: The AsyncResult of the search to wait for, or None to not wait.
+        :return: The result of the search: a tuple of the deepest completed depth, its value and its encoded move.
+                 None if the search completed no depth, was not waited for, or did not stop within
+                 PONDER_STOP_TIMEOUT.
+        """
+        self.shared_search_id.value += 1
+        if job is None:
+            return None
+        try:
+            return job.get(PONDER_STOP_TIMEOUT)
+        except (multiprocessing.TimeoutError, MemoryError):
+            return None
+
+    def close(self):
+        self._finalizer()
@@ -3,12 +3,11 @@
 # ===============================================================================
 
 import math
-import time
 import abstract
 from collections import defaultdict
 from checkers.consts import EM, PAWN_COLOR, KING_COLOR, OPPONENT_COLOR, MAX_TURNS_NO_JUMP, MY_COLORS, BACK_ROW, BOARD_ROWS
 from players import simple_player
-from utils import MiniMaxWithAlphaBetaPruning, INFINITY, run_with_limited_time, ExceededTimeError
+from utils import INFINITY, cached_utility
 
 # ===============================================================================
 # Globals
@@ -31,9 +30,13 @@ class Player(simple_player.Player):
     situations. The logic is detailed in the Utility method.
     """
 
+    # A piece is worth 100 in this utility.
+    aspiration_window = 50
+
     def __init__(self, setup_time, player_color, time_per_k_turns, k):
         simple_player.Player.__init__(self, setup_time, player_color, time_per_k_turns, k)
 
+    @cached_utility
     def utility(self, state):
 
         """
@@ -49,7 +52,7 @@ class Player(simple_player.Player):
         """
 
         # If there is no possible moves.
-        if len(state.get_possible_moves()) == 0:
+        if not state.has_any_move():
             return INFINITY if state.curr_player != self.color else -INFINITY
 
         if state.turns_since_last_jump >= MAX_TURNS_NO_JUMP:
@@ -229,75 +232,20 @@ class Player(simple_player.Player):
         ultimately results in a timeout.
         """
 
-        self.clock = time.process_time()
-        self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
+        possible_moves, ponder_result = self.begin_move(game_state, possible_moves)
 
         if len(possible_moves) == 1:
-
-            # If this was the last turn in current round.
-            if self.turns_remaining_in_round == 1:
-                self.turns_remaining_in_round = self.k  # Reset turns count.
-                self.time_remaining_in_round = self.time_per_k_turns  # Reset time count.
-
-            else:
-                self.turns_remaining_in_round -= 1  # Decrease turns amount by 1.
-                self.time_remaining_in_round -= (time.process_time() - self.clock)  # Update remaining time.
-
+            self.end_turn()  # Count the move of the round although nothing was searched.
             return possible_moves[0]
 
-        current_depth = 1
-        prev_alpha = -INFINITY
-
         # Choosing an arbitrary move in case Minimax does not return an answer.
         best_move = possible_moves[0]
 
-        # Initialize Minimax algorithm, still not running anything.
-        minimax = MiniMaxWithAlphaBetaPruning(self.utility, self.color, self.no_more_time,
-                                              self.selective_deepening_criterion)
-
         # Iterative deepening until the time runs out.
-        while True:
-
-            print('going to depth: {}, remaining time: {}, prev_alpha: {}, best_move: {}'.format(
-                current_depth,
-                self.time_for_current_move - (time.process_time() - self.clock),
-                prev_alpha,
-                best_move))
-
-            try:
-                (alpha, move), run_time = run_with_limited_time(
-                    minimax.search, (game_state, current_depth, -INFINITY, INFINITY, True), {},
-                    self.time_for_current_move - (time.process_time() - self.clock))
-
-            except (ExceededTimeError, MemoryError):
-                print('no more time, achieved depth {}'.format(current_depth))
-                break
-
-            if self.no_more_time():
-                print('no more time')
-                break
-
-            prev_alpha = alpha
+        for depth, alpha, move in self.run_search(game_state, ponder_result):
             best_move = move
 
-            if alpha == INFINITY:
-                print('the move: {} will guarantee victory.'.format(best_move))
-                break
-
-            if alpha == -INFINITY:
-                print('all is lost')
-                break
-
-            current_depth += 1
-
-        # If this was the last turn in current round.
-        if self.turns_remaining_in_round == 1:
-            self.turns_remaining_in_round = self.k
-            self.time_remaining_in_round = self.time_per_k_turns
-        else:
-            self.turns_remaining_in_round -= 1
-            self.time_remaining_in_round -= (time.process_time() - self.clock)
-        return best_move
+        return self.finish_move(game_state, best_move)
 
     def __repr__(self):
         return '{} {}'.format(abstract.AbstractPlayer.__repr__(self), 'better_h')
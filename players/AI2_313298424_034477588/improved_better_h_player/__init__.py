@@ -3,12 +3,12 @@
 # ===============================================================================
 
 import math
-import time
 import abstract
-from collections import defaultdict
-from checkers.consts import EM, PAWN_COLOR, KING_COLOR, OPPONENT_COLOR, MAX_TURNS_NO_JUMP, MY_COLORS, BACK_ROW, BOARD_ROWS
+from checkers.consts import PAWN_COLOR, KING_COLOR, OPPONENT_COLOR, MAX_TURNS_NO_JUMP, MY_COLORS, BACK_ROW, BOARD_ROWS, \
+    PLAYABLE_SQUARES
 from players import simple_player
-from utils import MiniMaxWithAlphaBetaPruning, INFINITY, run_with_limited_time, ExceededTimeError
+from checkers.evaluation import IncrementalEvaluation
+from utils import INFINITY, cached_utility
 
 # ===============================================================================
 # Globals
@@ -19,6 +19,14 @@ KING_WEIGHT = 1.5
 MIN_DEEPENING_DEPTH = 5
 
 
+def piece_square_table_index(other_pawn_count):
+    """
+    :return: The index in Player.piece_square_tables of the table of a player whose opponent has the given amount of
+             pawns.
+    """
+    return 0 if other_pawn_count >= 2 else 1
+
+
 # ===============================================================================
 # Player
 # ===============================================================================
@@ -29,13 +37,25 @@ class Player(simple_player.Player):
     """
     This class implements the improved_better_h player.
     This player has both an advanced utility calculation, a time management logic that saves time for future moves and a
-    selective deepening criterion that forces the minimax algorithm to deepen the search in case the next move is a
-    capture, even if the depth limit was already reached.
+    quiescence search that forces the minimax algorithm to deepen the search in case the next move is a capture, even
+    if the depth limit was already reached (up to max_quiescence_depth capture plies).
     """
 
+    # A piece is worth 100 in this utility.
+    aspiration_window = 50
+    max_quiescence_depth = 8
+
     def __init__(self, setup_time, player_color, time_per_k_turns, k):
         simple_player.Player.__init__(self, setup_time, player_color, time_per_k_turns, k)
 
+        # The scores of evaluate_position for every tool and location, while the other player has 2 pawns or more and
+        # when he has less. The game states keep their sums incrementally (see checkers.evaluation).
+        self.piece_square_tables = tuple(
+            {tool: {loc: self.evaluate_position(loc[1], loc[0], tool == KING_COLOR[color], other_pawn_count, color)
+                    for loc in PLAYABLE_SQUARES}
+             for color in OPPONENT_COLOR for tool in MY_COLORS[color]}
+            for other_pawn_count in (2, 0))
+
     def get_move(self, game_state, possible_moves):
 
         """
@@ -46,60 +66,25 @@ class Player(simple_player.Player):
         In the last turn of the cycle, we exhaust all the remaining time.
         """
 
-        self.clock = time.process_time()
-        self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
+        possible_moves, ponder_result = self.begin_move(game_state, possible_moves)
 
         # If there is only one possible move.
         if len(possible_moves) == 1:
-
-            # If this was the last turn in current round.
-            if self.turns_remaining_in_round == 1:
-                self.turns_remaining_in_round = self.k  # Reset turns count.
-                self.time_remaining_in_round = self.time_per_k_turns  # Reset time count.
-
-            else:
-                self.turns_remaining_in_round -= 1  # Decrease turns amount by 1.
-                self.time_remaining_in_round -= (time.process_time() - self.clock)  # Update remaining time.
-
+            self.end_turn()  # Count the move of the round although nothing was searched.
             return possible_moves[0]
 
-        current_depth = 1
         prev_alpha = -INFINITY
 
         # Choosing an arbitrary move in case Minimax does not return an answer.
         best_move = possible_moves[0]
 
-        # Initialize Minimax algorithm, still not running anything.
-        minimax = MiniMaxWithAlphaBetaPruning(self.utility, self.color, self.no_more_time,
-                                              self.selective_deepening_criterion)
-
         roundsNotChanged = 0
 
         # Iterative deepening until the time runs out.
-        while True:
-
-            print('going to depth: {}, remaining time: {}, prev_alpha: {}, best_move: {}'.format(
-                current_depth,
-                self.time_for_current_move - (time.process_time() - self.clock),
-                prev_alpha,
-                best_move))
-
-            try:
-                (alpha, move), run_time = run_with_limited_time(
-                    minimax.search, (game_state, current_depth, -INFINITY, INFINITY, True), {},
-                    self.time_for_current_move - (time.process_time() - self.clock))
-
-            except (ExceededTimeError, MemoryError):
-                print('no more time, achieved depth {}'.format(current_depth))
-                break
-
-            if self.no_more_time():
-                print('no more time')
-                break
+        for current_depth, alpha, move in self.run_search(game_state, ponder_result):
 
             # Check if both alpha and next best move according to the last search has not been changed.
-            if prev_alpha == alpha and move.origin_loc == best_move.origin_loc \
-                    and move.target_loc == best_move.target_loc and current_depth > MIN_DEEPENING_DEPTH:
+            if prev_alpha == alpha and move == best_move and current_depth > MIN_DEEPENING_DEPTH:
 
                 # If so, then increment the counter.
                 roundsNotChanged += 1
@@ -107,35 +92,18 @@ class Player(simple_player.Player):
             else:  # alpha or next best move were changed - Reset counter.
                 roundsNotChanged = 0
 
+            prev_alpha = alpha
+            best_move = move
+
             # If alpha and best move have not been changed in 3 cycles, stop searching and save time for future moves.
             if roundsNotChanged == 3 and self.turns_remaining_in_round > 1:
                 print('Best move and alpha has not changed for {} rounds, depth is {}.'.format(roundsNotChanged,
                                                                                                current_depth))
                 break
 
-            prev_alpha = alpha
-            best_move = move
-
-            if alpha == INFINITY:
-                print('the move: {} will guarantee victory.'.format(best_move))
-                break
-
-            if alpha == -INFINITY:
-                print('all is lost')
-                break
-
-            current_depth += 1
-
-        # If this was the last turn in current round.
-        if self.turns_remaining_in_round == 1:
-            self.turns_remaining_in_round = self.k  # Reset turns count.
-            self.time_remaining_in_round = self.time_per_k_turns  # Reset time count.
-        else:
-            self.turns_remaining_in_round -= 1  # Decrease turns amount by 1.
-            self.time_remaining_in_round -= (time.process_time() - self.clock)  # Update remaining time.
-
-        return best_move
+        return self.finish_move(game_state, best_move)
 
+    @cached_utility
     def utility(self, state):
 
         """
@@ -151,68 +119,44 @@ class Player(simple_player.Player):
         """
 
         # If there is no possible moves.
-        if len(state.get_possible_moves()) == 0:
+        if not state.has_any_move():
             return INFINITY if state.curr_player != self.color else -INFINITY
 
         if state.turns_since_last_jump >= MAX_TURNS_NO_JUMP:
             return 0
 
-        # A dictionary that will hold the counts of each type of piece.
-        piece_counts = defaultdict(lambda: 0)
-
-        # A dictionary that will hold the list of positions of each type of piece.
-        piece_locs = defaultdict(lambda: [])
-
-        for loc, loc_val in state.board.items():
-
-            # If current location is not empty.
-            if loc_val != EM:
-                piece_counts[loc_val] += 1  # Increment amount of current piece type.
-                piece_locs[loc_val].append(loc)  # Add the location of current piece.
+        # The piece counts, locations and position scores, kept up to date by the state while the search moves. A state
+        # without the incremental evaluation is evaluated by a full pass over its board.
+        enable_evaluation = getattr(state, 'enable_evaluation', None)
+        if enable_evaluation is not None:
+            evaluation = enable_evaluation(self.piece_square_tables)
+        else:
+            evaluation = IncrementalEvaluation(state.board, self.piece_square_tables)
+        piece_counts = evaluation.counts
+        piece_locs = evaluation.locs
 
         # Get opponent's color.
         opponent_color = OPPONENT_COLOR[self.color]
 
-        opponent_pos_sum = 0
-        my_pos_sum = 0
-        my_total_king_dist = 0
-
         # Count amount of pieces and amount of kings - ours and the opponent's.
-        my_pieces = piece_counts[PAWN_COLOR[self.color]] + piece_counts[KING_COLOR[self.color]]
-        opponent_pieces = piece_counts[PAWN_COLOR[opponent_color]] + piece_counts[KING_COLOR[opponent_color]]
+        my_pieces = evaluation.pieces(self.color)
+        opponent_pieces = evaluation.pieces(opponent_color)
         my_kings = piece_counts[KING_COLOR[self.color]]
         opponent_kings = piece_counts[KING_COLOR[opponent_color]]
 
-        # Iterate through all locations on the board.
-        for loc, loc_val in state.board.items():
-
-            # If current location is not empty.
-            if loc_val != EM:
-
-                # And if this location contains our color.
-                if loc_val in MY_COLORS[self.color]:
+        # Sum positions score of each player's pieces - The table depends on the amount of pawns the other player has
+        # (See evaluate_position function).
+        my_pos_sum = evaluation.sums[piece_square_table_index(piece_counts[PAWN_COLOR[opponent_color]])][self.color]
+        opponent_pos_sum = evaluation.sums[
+            piece_square_table_index(piece_counts[PAWN_COLOR[self.color]])][opponent_color]
 
-                    # Get score of current location - Give boost to strategic locations.
-                    my_pos = self.evaluate_position(loc[1], loc[0], loc_val == KING_COLOR[self.color],
-                                                    piece_counts[PAWN_COLOR[opponent_color]], self.color)
-                    # Sum positions score.
-                    my_pos_sum += my_pos
-
-                    # If current piece is a king.
-                    if loc_val == KING_COLOR[self.color]:
-
-                        # Calculate distances factor of all kings from all of opponent's pieces.
-                        dist = self.calculate_distance(loc, piece_locs[KING_COLOR[opponent_color]])
-                        dist += self.calculate_distance(loc, piece_locs[PAWN_COLOR[opponent_color]])
-                        my_total_king_dist += dist
-
-                else:  # This location contains the opponent's color.
-
-                    # Get score of current location - Give boost to strategic locations.
-                    opponent_pos = self.evaluate_position(loc[1], loc[0], loc_val == KING_COLOR[opponent_color],
-                                                          piece_counts[PAWN_COLOR[self.color]], opponent_color)
-                    # Sum opponent's positions score.
-                    opponent_pos_sum += opponent_pos
+        # Calculate distances factor of all our kings from all of opponent's pieces. The kings are visited in the
+        # order of the board, so the sum is the same as when going over the board.
+        my_total_king_dist = 0
+        for loc in sorted(piece_locs[KING_COLOR[self.color]], key=lambda loc: (loc[1], loc[0])):
+            dist = self.calculate_distance(loc, piece_locs[KING_COLOR[opponent_color]])
+            dist += self.calculate_distance(loc, piece_locs[PAWN_COLOR[opponent_color]])
+            my_total_king_dist += dist
 
         # Calculate total pieces difference and total kings difference.
         piece_difference = my_pieces - opponent_pieces
@@ -328,6 +272,7 @@ class Player(simple_player.Player):
         This method is used for selective deepening during the minimax search algorithm. In case the next move is a
         capture, this is a move that worths further investigation, thus we force the algorithm to keep searching even if
         the depth limit was already reached.
+        The search of this player uses the bounded quiescence search instead, which deepens on the same positions.
         """
 
         # Get all capture moves available in current state.
@@ -3,7 +3,8 @@
 # ===============================================================================
 
 import abstract
-from utils import MiniMaxWithAlphaBetaPruning, INFINITY, run_with_limited_time, ExceededTimeError
+from utils import MiniMaxWithAlphaBetaPruning, TranspositionTable, MoveOrdering, INFINITY, \
+    SearchExecutor, CancellationToken, Deadline, ExceededTimeError, ASPIRATION_WINDOW
 from checkers.consts import EM, PAWN_COLOR, KING_COLOR, OPPONENT_COLOR, MAX_TURNS_NO_JUMP
 import time
 from collections import defaultdict
@@ -15,6 +16,9 @@ from collections import defaultdict
 PAWN_WEIGHT = 1
 KING_WEIGHT = 1.5
 
+# Memory allowed for the transposition table, in bytes.
+TT_MEMORY_BUDGET = 32 * 1024 * 1024
+
 
 # ===============================================================================
 # Player
@@ -22,6 +26,9 @@ KING_WEIGHT = 1.5
 
 
 class Player(abstract.AbstractPlayer):
+    # Half width of the aspiration window around the previous depth's value, in utility units.
+    aspiration_window = ASPIRATION_WINDOW
+
 
     def __init__(self, setup_time, player_color, time_per_k_turns, k):
         abstract.AbstractPlayer.__init__(self, setup_time, player_color, time_per_k_turns, k)
@@ -33,9 +40,20 @@ class Player(abstract.AbstractPlayer):
         self.time_remaining_in_round = self.time_per_k_turns
         self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
 
+        # Search results and move ordering heuristics are kept across the iterative deepening depths and turns.
+        self.transposition_table = TranspositionTable(TT_MEMORY_BUDGET)
+        self.move_ordering = MoveOrdering()
+
+        # The time limit of the current move, polled by the searches through no_more_time.
+        self.deadline = Deadline()
+
+        # A single worker thread runs all the searches of this player.
+        self.search_executor = SearchExecutor()
+
     def get_move(self, game_state, possible_moves):
         self.clock = time.process_time()
         self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
+        self.deadline.start(self.time_for_current_move)
         if len(possible_moves) == 1:
             return possible_moves[0]
 
@@ -45,9 +63,18 @@ class Player(abstract.AbstractPlayer):
         # Choosing an arbitrary move in case Minimax does not return an answer:
         best_move = possible_moves[0]
 
+        # A new turn: old transposition table entries become replaceable, killers are reset and history decays.
+        self.transposition_table.new_search()
+        self.move_ordering.new_search()
+
+        # Cancelled when the time for this move is up, so the running search stops instead of being left behind.
+        cancellation_token = CancellationToken()
+
         # Initialize Minimax algorithm, still not running anything
         minimax = MiniMaxWithAlphaBetaPruning(self.utility, self.color, self.no_more_time,
-                                              self.selective_deepening_criterion)
+                                              self.selective_deepening_criterion,
+                                              self.transposition_table, self.move_ordering,
+                                              cancellation_token=cancellation_token, principal_variation=True)
 
         # Iterative deepening until the time runs out.
         while True:
@@ -59,9 +86,9 @@ class Player(abstract.AbstractPlayer):
                 best_move))
 
             try:
-                (alpha, move), run_time = run_with_limited_time(
-                    minimax.search, (game_state, current_depth, -INFINITY, INFINITY, True), {},
-                    self.time_for_current_move - (time.process_time() - self.clock))
+                (alpha, move), run_time = self.search_executor.run(
+                    minimax.aspiration_search, (game_state, current_depth, prev_alpha, self.aspiration_window), {},
+                    self.time_for_current_move - (time.process_time() - self.clock), cancellation_token)
             except (ExceededTimeError, MemoryError):
                 print('no more time, achieved depth {}'.format(current_depth))
                 break
@@ -92,7 +119,7 @@ class Player(abstract.AbstractPlayer):
         return best_move
 
     def utility(self, state):
-        if len(state.get_possible_moves()) == 0:
+        if not state.has_any_move():
             return INFINITY if state.curr_player != self.color else -INFINITY
         if state.turns_since_last_jump >= MAX_TURNS_NO_JUMP:
             return 0
@@ -121,8 +148,11 @@ class Player(abstract.AbstractPlayer):
         # Simple player does not selectively deepen into certain nodes.
         return False
 
+    def close(self):
+        self.search_executor.shutdown()
+
     def no_more_time(self):
-        return (time.process_time() - self.clock) >= self.time_for_current_move
+        return self.deadline.expired()
 
     def __repr__(self):
         return '{} {}'.format(abstract.AbstractPlayer.__repr__(self), 'simple')
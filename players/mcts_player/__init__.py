@@ -0,0 +1,254 @@
+#===============================================================================
+# Imports
+#===============================================================================
+
+import abstract
+import math
+import random
+import time
+from utils import Deadline, WALL_TIME_FACTOR
+from checkers.consts import TIE, OPPONENT_COLOR, PAWN_CODE, KING_CODE, MAX_TURNS_NO_JUMP
+from checkers.moves import encode_move
+
+#===============================================================================
+# Globals
+#===============================================================================
+
+# The exploration constant of UCT.
+EXPLORATION = 1.4
+
+# The number of playouts run in lockstep from every new leaf.
+PLAYOUT_BATCH = 8
+
+# Playouts still running after this many plies are decided by the material on the board.
+MAX_PLAYOUT_PLIES = 100
+
+PAWN_WEIGHT = 1
+KING_WEIGHT = 1.5
+
+#===============================================================================
+# Search tree
+#===============================================================================
+
+class Node:
+    """A node of the search tree: the position reached by a move.
+    The wins are counted for the player who made the move, that is the one choosing between this node and its
+    siblings.
+    """
+
+    def __init__(self, move, player, key, parent=None):
+        """
+        :param move: The move leading to this node (None for a new root).
+        :param player: The player who made the move.
+        :param key: The Zobrist key of the position after the move.
+        :param parent: The parent node.
+        """
+        self.move = move
+        self.player = player
+        self.key = key
+        self.parent = parent
+        self.children = []
+        # The moves without a child yet. None until the node is first expanded.
+        self.untried_moves = None
+        self.visits = 0
+        self.wins = 0.0
+
+    def select_child(self):
+        """
+        :return: The child with the highest upper confidence bound (UCT).
+        """
+        log_visits = math.log(self.visits)
+        return max(self.children,
+                   key=lambda child: child.wins / child.visits + EXPLORATION * math.sqrt(log_visits / child.visits))
+
+    def find_child(self, key):
+        for child in self.children:
+            if child.key == key:
+                return child
+        return None
+
+
+def material_winner(state):
+    """
+    :param state: A checkers.board.GameState.
+    :return: The player with more material on the board, or TIE.
+    """
+    scores = {}
+    for player in OPPONENT_COLOR:
+        scores[player] = (PAWN_WEIGHT * state.cells.count(PAWN_CODE[player]) +
+                          KING_WEIGHT * state.cells.count(KING_CODE[player]))
+    red, black = list(OPPONENT_COLOR)
+    if scores[red] == scores[black]:
+        return TIE
+    return red if scores[red] > scores[black] else black
+
+
+def run_playouts(state, count, rng, deadline):
+    """Plays count random games from the given state. The games are advanced together, one ply of every running
+    game per round, on copies of the state.
+
+    :param state: A checkers.board.GameState. It is not changed.
+    :param count: The number of playouts.
+    :param rng: The random.Random choosing the moves.
+    :param deadline: The Deadline of the move, polled once per round. The games still running when it expires are
+                     decided like the ones reaching MAX_PLAYOUT_PLIES.
+    :return: The list of the results: the winning player, or TIE.
+    """
+    boards = [state.copy() for _ in range(count)]
+    results = [None] * count
+    running = list(range(count))
+    for _ in range(MAX_PLAYOUT_PLIES):
+        if deadline.expired():
+            break
+        still_running = []
+        for i in running:
+            board = boards[i]
+            if board.turns_since_last_jump >= MAX_TURNS_NO_JUMP:
+                results[i] = TIE
+                continue
+            moves = board.get_possible_moves()
+            if not moves:
+                # This player has no moves. So the previous player is the winner.
+                results[i] = OPPONENT_COLOR[board.curr_player]
+                continue
+            board.make_move(moves[int(rng.random() * len(moves))])
+            still_running.append(i)
+        running = still_running
+        if not running:
+            break
+
+    for i in running:
+        results[i] = material_winner(boards[i])
+    return results
+
+#===============================================================================
+# Player
+#===============================================================================
+
+class Player(abstract.AbstractPlayer):
+    """A Monte Carlo tree search (UCT) player. Every iteration selects a leaf of the tree by the upper confidence
+    bound of the children, expands one of its moves and runs a batch of random playouts from the new node.
+    The tree is kept between the turns: the subtree of the position after the opponent's reply becomes the new root.
+    """
+
+    def __init__(self, setup_time, player_color, time_per_k_turns, k):
+        abstract.AbstractPlayer.__init__(self, setup_time, player_color, time_per_k_turns, k)
+        self.clock = time.thread_time()
+
+        # We are simply providing (remaining time / remaining turns) for each turn in round.
+        # Taking a spare time of 0.05 seconds.
+        self.turns_remaining_in_round = self.k
+        self.time_remaining_in_round = self.time_per_k_turns
+        self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
+        # The search runs on the thread of get_move, and its time is measured on the CPU clock of that thread, so the
+        # other threads of the process do not take from it. Its wall time is limited too (see WALL_TIME_FACTOR).
+        self.deadline = Deadline(time.thread_time)
+
+        self.rng = random.Random()
+        # The node of the player's last move, whose children are the opponent's replies.
+        self.last_move_node = None
+
+        # Totals over the game, to report the simulation rate.
+        self.simulations = 0
+        self.simulation_time = 0
+
+    def get_move(self, game_state, possible_moves):
+        self.clock = time.thread_time()
+        self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
+        self.deadline.start(self.time_for_current_move, self.time_for_current_move * WALL_TIME_FACTOR)
+
+        if len(possible_moves) > 1:
+            root = self.find_root(game_state)
+            simulations = self.search(game_state.copy(), root)
+            best_child = max(root.children, key=lambda child: child.visits)
+            move_code = encode_move(best_child.move)
+            best_move = [move for move in possible_moves if encode_move(move) == move_code][0]
+
+            run_time = time.thread_time() - self.clock
+            self.simulations += simulations
+            self.simulation_time += run_time
+            print('simulations: {} ({} in the tree), {:.0f} simulations/sec, best move: {} won {:.1f}/{}'.format(
+                simulations, root.visits, simulations / max(run_time, 1e-9), best_move, best_child.wins,
+                best_child.visits))
+
+            # Only the subtree of the chosen move is kept.
+            best_child.parent = None
+            self.last_move_node = best_child
+        else:
+            best_move = possible_moves[0]
+            self.last_move_node = None
+
+        if self.turns_remaining_in_round == 1:
+            self.turns_remaining_in_round = self.k
+            self.time_remaining_in_round = self.time_per_k_turns
+        else:
+            self.turns_remaining_in_round -= 1
+            self.time_remaining_in_round -= (time.thread_time() - self.clock)
+        return best_move
+
+    def find_root(self, game_state):
+        """
+        :return: The node of the given state in the tree kept from the last turn, or a new tree.
+        """
+        if self.last_move_node is not None:
+            root = self.last_move_node.find_child(game_state.key)
+            if root is not None:
+                root.parent = None
+                return root
+        return Node(None, OPPONENT_COLOR[game_state.curr_player], game_state.key)
+
+    def search(self, root_state, root):
+        """Runs MCTS iterations from the root until the time is up (at least one).
+
+        :param root_state: The state of the root. It is left unchanged.
+        :param root: The root node.
+        :return: The number of playouts run.
+        """
+        simulations = 0
+        while True:
+            # Selection: down the tree while the nodes are fully expanded.
+            node = root
+            undo_stack = []
+            while node.untried_moves is not None and not node.untried_moves and node.children:
+                node = node.select_child()
+                undo_stack.append(root_state.make_move(node.move))
+
+            # Expansion.
+            if node.untried_moves is None:
+                node.untried_moves = root_state.get_possible_moves()
+                self.rng.shuffle(node.untried_moves)
+            if node.untried_moves:
+                move = node.untried_moves.pop()
+                player = root_state.curr_player
+                undo_stack.append(root_state.make_move(move))
+                child = Node(move, player, root_state.key, node)
+                node.children.append(child)
+                node = child
+
+            # Simulation.
+            results = run_playouts(root_state, PLAYOUT_BATCH, self.rng, self.deadline)
+            simulations += len(results)
+
+            # Backpropagation.
+            while node is not None:
+                node.visits += len(results)
+                node.wins += sum(1 if result == node.player else 0.5 if result == TIE else 0 for result in results)
+                node = node.parent
+
+            while undo_stack:
+                root_state.unmake_move(undo_stack.pop())
+
+            if self.deadline.expired():
+                return simulations
+
+    def simulation_rate(self):
+        """
+        :return: The average number of playouts per second over the game so far.
+        """
+        return self.simulations / self.simulation_time if self.simulation_time else 0
+
+    def __repr__(self):
+        return '{} {} ({:.0f} simulations/sec)'.format(abstract.AbstractPlayer.__repr__(self), 'mcts',
+                                                       self.simulation_rate())
+
+# c:\python35\python.exe run_game.py 3 3 3 y mcts_player simple_player
@@ -4,8 +4,14 @@
 #===============================================================================
 
 import abstract
-from utils import MiniMaxWithAlphaBetaPruning, INFINITY, run_with_limited_time, ExceededTimeError
+from utils import MiniMaxWithAlphaBetaPruning, TranspositionTable, MoveOrdering, INFINITY, \
+    SearchExecutor, CancellationToken, Deadline, ExceededTimeError, ASPIRATION_WINDOW, SearchStatistics, \
+    InstrumentedMiniMax, EvaluationCache, cached_utility, WALL_TIME_FACTOR
+from checkers.moves import encode_move
+from checkers.tablebase import TablebaseProber
+from checkers.opening_book import OpeningBook
 from checkers.consts import EM, PAWN_COLOR, KING_COLOR, OPPONENT_COLOR, MAX_TURNS_NO_JUMP
+from parallel import RootSplitPool, ParallelRootSearch, LazySMPPool, LazySMPSearch, PonderPool, in_worker_process
 import time
 from collections import defaultdict
 
@@ -16,14 +22,50 @@ from collections import defaultdict
 PAWN_WEIGHT = 1
 KING_WEIGHT = 1.5
 
+# Memory allowed for the transposition table, in bytes.
+TT_MEMORY_BUDGET = 32 * 1024 * 1024
+
+# The number of positions the evaluation cache holds.
+EVALUATION_CACHE_SIZE = 1 << 18
+
 #===============================================================================
 # Player
 #===============================================================================
 
 class Player(abstract.AbstractPlayer):
+    # Half width of the aspiration window around the previous depth's value, in utility units.
+    aspiration_window = ASPIRATION_WINDOW
+
+    # The number of capture plies the quiescence search may add at the depth limit (see
+    # utils.MiniMaxWithAlphaBetaPruning.quiescence), or None to search no further than the depth limit.
+    max_quiescence_depth = None
+
+    # The number of worker processes the root moves are split between (see parallel.ParallelRootSearch). With 1, the
+    # player searches in its own process.
+    search_processes = 1
+
+    # The number of Lazy SMP helper processes searching alongside the player on a shared transposition table (see
+    # parallel.LazySMPPool). With 0, the player searches alone.
+    lazy_smp_workers = 0
+
+    # Whether the player keeps searching during the opponent's turn, on the position it expects after the
+    # opponent's best reply (see start_pondering). The search runs in a low priority process (see
+    # parallel.PonderPool).
+    ponder = False
+
+    # The directory of the endgame tablebases the searches probe (see build_tablebase.py), or None.
+    tablebase_directory = None
+
+    # The path of the opening book the player plays from (see build_opening_book.py), or None.
+    opening_book_path = None
+
+    # Whether the searches collect SearchStatistics (see utils.InstrumentedMiniMax), and the JSON lines file they are
+    # written to. Giving a file turns the statistics on.
+    collect_search_statistics = False
+    search_statistics_log = None
+
     def __init__(self, setup_time, player_color, time_per_k_turns, k):
         abstract.AbstractPlayer.__init__(self, setup_time, player_color, time_per_k_turns, k)
-        self.clock = time.process_time()
 
         # We are simply providing (remaining time / remaining turns) for each turn in round.
         # Taking a spare time of 0.05 seconds.
@@ -31,66 +73,288 @@ class Player(abstract.AbstractPlayer):
         self.time_remaining_in_round = self.time_per_k_turns
         self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
 
+        # Search results and move ordering heuristics are kept across the iterative deepening depths and turns.
+        self.transposition_table = TranspositionTable(TT_MEMORY_BUDGET)
+        self.move_ordering = MoveOrdering()
+        # The utilities of the positions evaluated, kept across depths and turns (see utils.cached_utility).
+        self.evaluation_cache = EvaluationCache(EVALUATION_CACHE_SIZE)
+
+        # The tablebase files are memory mapped, so players in several processes share them.
+        self.tablebase = TablebaseProber(self.tablebase_directory) if self.tablebase_directory else None
+
+        self.opening_book = OpeningBook(self.opening_book_path) if self.opening_book_path else None
+
+        self.search_statistics = None
+        if self.collect_search_statistics or self.search_statistics_log:
+            self.search_statistics = SearchStatistics(self.search_statistics_log)
+
+        # A single worker thread runs all the searches of this player.
+        self.search_executor = SearchExecutor()
+
+        # The time limit of the current move, polled by the searches through no_more_time. It is measured on the CPU
+        # clock of the worker thread, so the other threads of the process (e.g. the opponent's) do not take from it.
+        self.deadline = Deadline(self.search_executor.cpu_time)
+
+        self.root_split_pool = None
+        self.lazy_smp_pool = None
+        if self.lazy_smp_workers > 0 and not in_worker_process():
+            self.lazy_smp_pool = LazySMPPool(type(self).__module__, (setup_time, player_color, time_per_k_turns, k),
+                                             self.lazy_smp_workers, TT_MEMORY_BUDGET)
+            self.transposition_table = self.lazy_smp_pool.table
+            self.deadline = Deadline(time.monotonic)
+        elif self.search_processes > 1 and not in_worker_process():
+            self.root_split_pool = RootSplitPool(type(self).__module__,
+                                                 (setup_time, player_color, time_per_k_turns, k),
+                                                 self.search_processes)
+            # The search time is spent by the workers, so the time limit is measured on the wall clock.
+            self.deadline = Deadline(time.monotonic)
+        self.clock = self.deadline.clock()
+        self.wall_time_end = time.monotonic()
+
+        # The background search between the moves, on the transposition table of the player's searches.
+        self.ponder_pool = None
+        if self.ponder and not in_worker_process():
+            self.ponder_pool = PonderPool(type(self).__module__, (setup_time, player_color, time_per_k_turns, k),
+                                          TT_MEMORY_BUDGET, self.lazy_smp_pool and self.lazy_smp_pool.table)
+            self.transposition_table = self.ponder_pool.table
+        self.ponder_state = None
+        self.ponder_job = None
+        self.ponder_hits = 0
+        self.ponder_misses = 0
+
     def get_move(self, game_state, possible_moves):
-        self.clock = time.process_time()
-        self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
+        possible_moves, ponder_result = self.begin_move(game_state, possible_moves)
         if len(possible_moves) == 1:
             return possible_moves[0]
 
+        # Choosing an arbitrary move in case Minimax does not return an answer:
+        best_move = possible_moves[0]
+        for depth, alpha, move in self.run_search(game_state, ponder_result):
+            best_move = move
+
+        return self.finish_move(game_state, best_move)
+
+    def begin_move(self, game_state, possible_moves):
+        """Starts the clock of the move and stops the pondering.
+
+        :param game_state: The state of the player's move.
+        :param possible_moves: The possible moves of the state.
+        :return: A tuple: (The moves to choose from, the ponder hit result of stop_pondering or None). A move from the
+                 opening book is given as the only move to choose from, so it is played like a forced move.
+        """
+        self.clock = self.deadline.clock()
+        self.time_for_current_move = self.time_remaining_in_round / self.turns_remaining_in_round - 0.05
+        self.deadline.start(self.time_for_current_move)
+        # The searches stop themselves on the deadline, and the executor gives up on them at this wall time.
+        self.wall_time_end = time.monotonic() + self.time_remaining_in_round * WALL_TIME_FACTOR
+        ponder_result = self.stop_pondering(game_state, possible_moves)
+
+        book_move = self.opening_book_move(game_state, possible_moves)
+        if book_move is not None:
+            return [book_move], None
+        return possible_moves, ponder_result
+
+    def run_search(self, game_state, ponder_result=None):
+        """Iterative deepening on the state until the time for the current move runs out, or the value of the state
+        is decided.
+
+        :param game_state: The state of the player's move.
+        :param ponder_result: The ponder hit result of begin_move, if any. It is yielded first and the search goes on
+                              from the depth after it.
+        :return: A generator of tuples: (The depth, its value, its move), one for every depth completed in time.
+        """
         current_depth = 1
         prev_alpha = -INFINITY
+        best_move = None
+
+        # A ponder hit: this position was already searched during the opponent's turn.
+        if ponder_result is not None:
+            current_depth, prev_alpha, best_move = ponder_result
+            yield ponder_result
+            current_depth += 1
+
+        # A new turn: old transposition table entries become replaceable, killers are reset and history decays.
+        self.transposition_table.new_search()
+        self.move_ordering.new_search()
+
+        # Cancelled when the time for this move is up, so the running search stops instead of being left behind.
+        cancellation_token = CancellationToken()
 
-        # Choosing an arbitrary move in case Minimax does not return an answer:
-        best_move = possible_moves[0]
-        
         # Initialize Minimax algorithm, still not running anything
-        minimax = MiniMaxWithAlphaBetaPruning(self.utility, self.color, self.no_more_time, 
-                                              self.selective_deepening_criterion)
+        minimax = self.create_search(cancellation_token)
 
         # Iterative deepening until the time runs out.
         while True:
-            
+
             print('going to depth: {}, remaining time: {}, prev_alpha: {}, best_move: {}'.format(
-                current_depth, 
-                self.time_for_current_move - (time.process_time() - self.clock),
+                current_depth,
+                self.time_for_current_move - (self.deadline.clock() - self.clock),
                 prev_alpha,
                 best_move))
 
             try:
-                (alpha, move), run_time = run_with_limited_time(
-                    minimax.search, (game_state, current_depth, -INFINITY, INFINITY, True), {},
-                    self.time_for_current_move - (time.process_time() - self.clock))
+                (alpha, move), run_time = self.search_executor.run(
+                    minimax.aspiration_search, (game_state, current_depth, prev_alpha, self.aspiration_window), {},
+                    self.wall_time_end - time.monotonic(), cancellation_token)
             except (ExceededTimeError, MemoryError):
                 print('no more time, achieved depth {}'.format(current_depth))
-                break
+                return
 
             if self.no_more_time():
                 print('no more time')
-                break
+                return
 
             prev_alpha = alpha
             best_move = move
+            yield current_depth, alpha, move
 
             if alpha == INFINITY:
                 print('the move: {} will guarantee victory.'.format(best_move))
-                break
+                return
 
             if alpha == -INFINITY:
                 print('all is lost')
-                break
+                return
 
             current_depth += 1
 
+    def end_turn(self):
+        """Charges the time of the current move to the round.
+        """
         if self.turns_remaining_in_round == 1:
             self.turns_remaining_in_round = self.k
             self.time_remaining_in_round = self.time_per_k_turns
         else:
             self.turns_remaining_in_round -= 1
-            self.time_remaining_in_round -= (time.process_time() - self.clock)
+            self.time_remaining_in_round -= (self.deadline.clock() - self.clock)
+
+    def finish_move(self, game_state, best_move):
+        """Ends the turn of a searched move and starts pondering on the position after it.
+
+        :return: best_move.
+        """
+        print('evaluation cache hit rate: {:.2f}'.format(self.evaluation_cache.hit_rate()))
+        if self.lazy_smp_pool is not None:
+            self.lazy_smp_pool.stop_helpers()
+        self.end_turn()
+        self.start_pondering(game_state, best_move)
         return best_move
 
+    def create_minimax(self, cancellation_token=None, no_more_time=None):
+        """Builds the minimax search this player runs in a single process.
+
+        :param cancellation_token: The CancellationToken of the search.
+        :param no_more_time: The time limit of the search, no_more_time of the player by default.
+        """
+        minimax = MiniMaxWithAlphaBetaPruning(self.utility, self.color, no_more_time or self.no_more_time,
+                                              self.selective_deepening_criterion,
+                                              self.transposition_table, self.move_ordering,
+                                              max_quiescence_depth=self.max_quiescence_depth,
+                                              cancellation_token=cancellation_token, principal_variation=True,
+                                              tablebase=self.tablebase)
+        return self.instrument(minimax)
+
+    def instrument(self, minimax):
+        """
+        :return: The given minimax, collecting the player's search_statistics if it has them.
+        """
+        if self.search_statistics is None:
+            return minimax
+        return InstrumentedMiniMax(minimax, self.search_statistics)
+
+    def create_search(self, cancellation_token):
+        """Builds the search of the current move: a Lazy SMP search when the player has lazy_smp_workers, a
+        parallel root split when it has search_processes, the player's minimax otherwise.
+        """
+        if self.search_statistics is not None:
+            self.search_statistics.new_move()
+        if self.lazy_smp_pool is not None:
+            return LazySMPSearch(self.lazy_smp_pool, self.create_minimax(cancellation_token),
+                                 self.time_for_current_move)
+        if self.root_split_pool is not None:
+            return ParallelRootSearch(self.root_split_pool, self.no_more_time, self.time_for_current_move,
+                                      cancellation_token)
+        return self.create_minimax(cancellation_token)
+
+    def opening_book_move(self, game_state, possible_moves):
+        """
+        :return: A move the opening book has for the state, or None if there is no book or the state is not in it.
+        """
+        if self.opening_book is None:
+            return None
+        return self.opening_book.choose_move(game_state, possible_moves)
+
+    def start_pondering(self, game_state, move):
+        """Starts searching, in the background, the position after the given move and the opponent's expected reply:
+        the reply the transposition table has as best for the opponent. Does nothing unless the player has ponder.
+
+        :param game_state: The state the move is played in. It is not changed.
+        :param move: The move the player plays.
+        """
+        if self.ponder_pool is None:
+            return
+        state = game_state.copy()
+        state.make_move(move)
+        entry = self.transposition_table.probe(state.key)
+        replies = [reply for reply in state.get_possible_moves()
+                   if entry is not None and encode_move(reply) == entry[4]]
+        if not replies:
+            return
+        state.make_move(replies[0])
+        if not state.get_possible_moves():
+            return
+
+        self.ponder_state = state
+        self.ponder_job = self.ponder_pool.start(state)
+
+    def stop_pondering(self, game_state, possible_moves):
+        """Stops the background search, if any. On a ponder hit, waits for its result.
+
+        :param game_state: The state of the player's move.
+        :param possible_moves: The possible moves of the state.
+        :return: On a ponder hit (the opponent played the expected reply), a tuple of the deepest completed depth, its
+                 value and its move from possible_moves. Otherwise None.
+        """
+        if self.ponder_job is None:
+            return None
+        if self.ponder_state != game_state:
+            self.ponder_misses += 1
+            self.cancel_pondering()
+            return None
+        self.ponder_hits += 1
+        result = self.ponder_pool.stop(self.ponder_job)
+        self.ponder_job = None
+        if result is None:
+            return None
+
+        depth, alpha, move_code = result
+        print('ponder hit, searched to depth {}'.format(depth))
+        for possible_move in possible_moves:
+            if encode_move(possible_move) == move_code:
+                return depth, alpha, possible_move
+        return None
+
+    def cancel_pondering(self):
+        """Stops the background search, if any, without waiting for it.
+        """
+        if self.ponder_job is None:
+            return
+        self.ponder_pool.stop()
+        self.ponder_job = None
+
+    def close(self):
+        self.cancel_pondering()
+        self.search_executor.shutdown()
+        if self.ponder_pool is not None:
+            self.ponder_pool.close()
+        if self.root_split_pool is not None:
+            self.root_split_pool.close()
+        if self.lazy_smp_pool is not None:
+            self.lazy_smp_pool.close()
+
+    @cached_utility
     def utility(self, state):
-        if len(state.get_possible_moves()) == 0:
+        if not state.has_any_move():
             return INFINITY if state.curr_player != self.color else -INFINITY
         if state.turns_since_last_jump >= MAX_TURNS_NO_JUMP:
             return 0
@@ -120,7 +384,7 @@ class Player(abstract.AbstractPlayer):
         return False
 
     def no_more_time(self):
-        return (time.process_time() - self.clock) >= self.time_for_current_move
+        return self.deadline.expired()
 
     def __repr__(self):
         return '{} {}'.format(abstract.AbstractPlayer.__repr__(self), 'simple')
@@ -66,6 +66,7 @@ class GameRunner:
         black_player_exceeded = self.setup_player(sys.modules[self.black_player].Player, BLACK_PLAYER)
         winner = self.handle_time_expired(red_player_exceeded, black_player_exceeded)
         if winner: # One of the players exceeded the setup time
+            self.close_players()
             return winner
 
         board_state = GameState()
@@ -114,9 +115,16 @@ class GameRunner:
                     # K rounds completed. Resetting timers.
                     remaining_run_times = copy.deepcopy(self.player_move_times)
 
+        self.close_players()
         self.end_game(winner)
         return winner
 
+    def close_players(self):
+        """Lets the players stop their background work once the game is over (see AbstractPlayer.close).
+        """
+        for player in self.players.values():
+            player.close()
+
     @staticmethod
     def end_game(winner):
         if winner == TIE:
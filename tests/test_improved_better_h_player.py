@@ -0,0 +1,72 @@
+import random
+import unittest
+from checkers.board import GameState
+from checkers.consts import RED_PLAYER
+from players.AI2_313298424_034477588.improved_better_h_player import Player
+from utils import INFINITY
+
+
+class StateWithoutEvaluation(GameState):
+    """A state without the incremental evaluation hook (GameState.enable_evaluation), like the states of other board
+    implementations.
+    """
+
+    def __getattribute__(self, name):
+        if name == 'enable_evaluation':
+            raise AttributeError(name)
+        return GameState.__getattribute__(self, name)
+
+
+def midgame_state(plies, seed):
+    """
+    :return: The state after the given number of random plies from the initial position.
+    """
+    rng = random.Random(seed)
+    state = GameState()
+    for _ in range(plies):
+        state.make_move(rng.choice(state.get_possible_moves()))
+    return state
+
+
+def without_evaluation(state):
+    """
+    :return: A StateWithoutEvaluation copy of the state.
+    """
+    plain = StateWithoutEvaluation.__new__(StateWithoutEvaluation)
+    plain.__dict__.update(state.copy().__dict__)
+    return plain
+
+
+class UtilityStateTypesTest(unittest.TestCase):
+
+    def setUp(self):
+        # A player per state type, so the evaluation cache of one does not answer for the other.
+        self.players = [Player(INFINITY, RED_PLAYER, INFINITY, 1) for _ in range(2)]
+        for player in self.players:
+            player.deadline.start(INFINITY)
+
+    def tearDown(self):
+        for player in self.players:
+            player.close()
+
+    def test_utility_without_evaluation_hook(self):
+        for seed in range(5):
+            state = midgame_state(12, seed)
+            plain = without_evaluation(state)
+            self.assertRaises(AttributeError, getattr, plain, 'enable_evaluation')
+            self.assertEqual(self.players[0].utility(state), self.players[1].utility(plain))
+
+    def test_search_both_state_types(self):
+        for seed in range(3):
+            state = midgame_state(10, seed)
+            if state.curr_player != RED_PLAYER:
+                state.make_move(state.get_possible_moves()[0])
+            plain = without_evaluation(state)
+            results = [player.create_minimax().search(game_state, 4, -INFINITY, INFINITY, True)
+                       for player, game_state in zip(self.players, (state, plain))]
+            self.assertEqual(results[0][0], results[1][0])
+            self.assertEqual(results[0][1], results[1][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import time
+import unittest
+from checkers.board import GameState
+from checkers.consts import RED_PLAYER, BLACK_PLAYER
+from players import simple_player
+from utils import INFINITY
+
+# The opponent's wall time may grow by this factor at most while the player ponders.
+MAX_SLOWDOWN = 1.25
+# The depth of the opponent's search, long enough for the scheduler to share the CPU.
+OPPONENT_DEPTH = 8
+
+
+class Player(simple_player.Player):
+    """The pondering player. The ponder process builds its own instance from this module (see parallel.PonderPool).
+    """
+    ponder = True
+
+
+def opponent_search_time(opponent, state):
+    """
+    :return: The best wall time, over a few runs, of a fixed depth search of the opponent.
+    """
+    times = []
+    for _ in range(5):
+        opponent.transposition_table.clear()
+        opponent.evaluation_cache.clear()
+        start = time.perf_counter()
+        opponent.create_minimax().search(state, OPPONENT_DEPTH, -INFINITY, INFINITY, True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+class PonderingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.player = Player(INFINITY, RED_PLAYER, 2, 5)
+        self.opponent = simple_player.Player(INFINITY, BLACK_PLAYER, INFINITY, 1)
+        self.opponent.deadline.start(INFINITY)
+
+    def tearDown(self):
+        self.player.close()
+        self.opponent.close()
+
+    def test_opponent_wall_time_unaffected(self):
+        state = GameState()
+        state.make_move(self.player.get_move(state, state.get_possible_moves()))
+        self.assertIsNotNone(self.player.ponder_job)
+        # A first search, so that neither of the measured ones pays for warming up.
+        opponent_search_time(self.opponent, state)
+        pondering_time = opponent_search_time(self.opponent, state)
+        self.assertIsNotNone(self.player.ponder_job)
+
+        self.player.cancel_pondering()
+        idle_time = opponent_search_time(self.opponent, state)
+        self.assertLess(pondering_time, idle_time * MAX_SLOWDOWN,
+                        'opponent search: {:.3f}s idle, {:.3f}s while pondering'.format(idle_time, pondering_time))
+
+    def test_ponder_hit(self):
+        state = GameState()
+        self.player.get_move(state, state.get_possible_moves())
+        pondered_state = self.player.ponder_state
+        time.sleep(0.2)
+        result = self.player.stop_pondering(pondered_state, pondered_state.get_possible_moves())
+        self.assertEqual(self.player.ponder_hits, 1)
+        self.assertIsNotNone(result)
+        self.assertGreaterEqual(result[0], 1)
+        self.assertIn(result[2], pondered_state.get_possible_moves())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,19 @@
+import unittest
+from checkers.consts import RED_PLAYER, BLACK_PLAYER
+from checkers.tablebase import SLICE_TOOLS, slice_size, slice_positions, position_index
+
+# Slices with every kind of piece, and more red pawns than the squares only a red pawn may stand on.
+SLICES = [(1, 0, 0, 1), (0, 1, 1, 0), (1, 0, 1, 0), (0, 1, 0, 2), (2, 0, 2, 0), (1, 1, 1, 0), (5, 0, 0, 0)]
+
+
+class PositionIndexTest(unittest.TestCase):
+
+    def test_legal_positions_fill_the_slice(self):
+        for material in SLICES:
+            indexes = sorted(position_index(dict(zip(SLICE_TOOLS, bitboards)), player, material)
+                             for bitboards in slice_positions(material) for player in (RED_PLAYER, BLACK_PLAYER))
+            self.assertEqual(indexes, list(range(slice_size(material))), material)
+
+
+if __name__ == '__main__':
+    unittest.main()
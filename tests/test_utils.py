@@ -0,0 +1,69 @@
+import threading
+import unittest
+from checkers.board import GameState
+from checkers.consts import RED_PLAYER, MAX_TURNS_NO_JUMP
+from players import simple_player
+from utils import INFINITY, SearchExecutor, CancellationToken
+
+SEARCH_DEPTH = 4
+
+
+def kings_state(turns_since_last_jump):
+    """
+    :return: Red to move with two kings on the first row, against a black king on the last row: no capture is
+             possible within SEARCH_DEPTH plies, so red is up material unless the game is drawn first.
+    """
+    return GameState.decode((0, (1 << 0) | (1 << 1), 0, 1 << 31, RED_PLAYER, turns_since_last_jump))
+
+
+class NoJumpDrawTranspositionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.player = simple_player.Player(INFINITY, RED_PLAYER, INFINITY, 1)
+        self.player.deadline.start(INFINITY)
+
+    def tearDown(self):
+        self.player.close()
+
+    def search(self, turns_since_last_jump):
+        return self.player.create_minimax().search(kings_state(turns_since_last_jump), SEARCH_DEPTH, -INFINITY,
+                                                   INFINITY, True)[0]
+
+    def fresh_search(self, turns_since_last_jump):
+        self.player.transposition_table.clear()
+        return self.search(turns_since_last_jump)
+
+    def test_values_stored_far_from_the_draw(self):
+        near = MAX_TURNS_NO_JUMP - 1
+        near_value = self.fresh_search(near)
+        far_value = self.fresh_search(0)
+        self.assertEqual(near_value, 0)
+        self.assertGreater(far_value, 0)
+        # The table now holds the positions of the search far from the draw.
+        self.assertEqual(self.search(near), near_value)
+
+    def test_values_stored_near_the_draw(self):
+        near = MAX_TURNS_NO_JUMP - 1
+        far_value = self.fresh_search(0)
+        self.fresh_search(near)
+        self.assertEqual(self.search(0), far_value)
+
+
+class SearchExecutorTest(unittest.TestCase):
+
+    def test_shutdown_stops_the_worker(self):
+        executor = SearchExecutor()
+        result, _ = executor.run(sum, ((1, 2),), {}, INFINITY, CancellationToken())
+        self.assertEqual(result, 3)
+        executor.shutdown()
+        self.assertFalse(executor.worker.is_alive())
+
+    def test_closed_players_leave_no_threads(self):
+        threads = threading.active_count()
+        for _ in range(3):
+            simple_player.Player(INFINITY, RED_PLAYER, INFINITY, 1).close()
+        self.assertEqual(threading.active_count(), threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
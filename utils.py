@@ -1,13 +1,83 @@
 """Generic utility functions
 """
 # from __future__ import print_function
+import json
+import functools
 from threading import Thread
-from queue import Queue
+from queue import Queue, Empty
 import time
-import copy
+from checkers.moves import ORIGIN_TARGET_MASK
+from checkers.tablebase import WIN, DRAW, MAX_DISTANCE
+from checkers.consts import MAX_TURNS_NO_JUMP
 
 INFINITY = float(6000)
 
+# Bound types of the values stored in a transposition table.
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# A Deadline reads the clock about once per this many seconds of search.
+DEADLINE_CHECK_PERIOD = 0.002
+# Bounds on the number of polls between two clock reads of a Deadline.
+DEADLINE_MAX_INTERVAL = 1000
+
+# The players measure the time of a move on a CPU clock. The wall time of a move is limited too, to this factor of its
+# time: the game runner gives up on a move after 1.5 times the time left in the round, however the CPU is shared.
+WALL_TIME_FACTOR = 1.25
+
+# The width of the null windows of the principal variation search. The values are floats, so any positive width
+# works: a move is re-searched as soon as its value is proven to be strictly inside the real window.
+NULL_WINDOW = 1e-6
+# Default half width of the aspiration window around the previous iteration's value.
+ASPIRATION_WINDOW = 0.5
+
+# Rough size in bytes of one transposition table entry (the entry tuple, its values and the slot pointer).
+TT_ENTRY_BYTES = 200
+
+# Values beyond this (and short of INFINITY) are tablebase wins and losses, which depend on the ply they are found at
+# (see MiniMaxWithAlphaBetaPruning.tablebase_value). It is far above the utilities of the players.
+TABLEBASE_VALUE_THRESHOLD = INFINITY / 2
+
+
+def value_to_table(value, ply):
+    """The tablebase wins and losses of the search are counted from its root, which changes from one search to the
+    next, so a transposition table keeps them counted from the node they are stored for.
+
+    :param value: A value of the search.
+    :param ply: The distance of the node from the root of the search.
+    :return: The value to store in the transposition table.
+    """
+    if TABLEBASE_VALUE_THRESHOLD < value < INFINITY:
+        return value + ply
+    if -INFINITY < value < -TABLEBASE_VALUE_THRESHOLD:
+        return value - ply
+    return value
+
+
+def reaches_no_jump_draw(state, depth):
+    """The value of a search that may reach the draw by MAX_TURNS_NO_JUMP depends on turns_since_last_jump, which the
+    key of the position (GameState.key) does not include, so the transposition table neither keeps nor answers it.
+
+    :param state: The state of the search node.
+    :param depth: The depth the node is searched to. Every ply adds half a turn to turns_since_last_jump.
+    :return: Whether the draw may be reached within depth plies of the state.
+    """
+    return state.turns_since_last_jump + depth / 2 >= MAX_TURNS_NO_JUMP
+
+
+def value_from_table(value, ply):
+    """
+    :param value: A value read from the transposition table (see value_to_table).
+    :param ply: The distance of the node from the root of the search.
+    :return: The value for the search.
+    """
+    if TABLEBASE_VALUE_THRESHOLD < value < INFINITY:
+        return value - ply
+    if -INFINITY < value < -TABLEBASE_VALUE_THRESHOLD:
+        return value + ply
+    return value
+
 
 class ExceededTimeError(RuntimeError):
     """Thrown when the given function exceeded its runtime.
@@ -27,7 +97,8 @@ def function_wrapper(func, args, kwargs, result_queue):
     start = time.process_time()
     try:
         result = func(*args, **kwargs)
-    except MemoryError as e:
+    except Exception as e:
+        # Any error is handed to the parent, which would otherwise wait for a result forever.
         result_queue.put(e)
         return
 
@@ -44,6 +115,7 @@ def run_with_limited_time(func, args, kwargs, time_limit):
     :param time_limit: The time limit in seconds (can be float).
     :return: A tuple: The function's return value unchanged, and the running time for the function.
     :raises PlayerExceededTimeError: If player exceeded its given time.
+    :raises Exception: The error the function raised, if any.
     """
     q = Queue()
     t = Thread(target=function_wrapper, args=(func, args, kwargs, q))
@@ -57,14 +129,436 @@ def run_with_limited_time(func, args, kwargs, time_limit):
         raise ExceededTimeError
 
     q_get = q.get()
-    if isinstance(q_get, MemoryError):
+    if isinstance(q_get, BaseException):
         raise q_get
     return q_get
 
 
+class Deadline:
+    """A time limit that is cheap to poll from the inner loops of a search.
+
+    Reading the process clock is a system call, so expired() only reads it once every few polls. The number of polls
+    between two reads adapts to the measured polling rate, aiming at a read every DEADLINE_CHECK_PERIOD seconds, and
+    once the time is up the result is cached. An optional wall-clock limit is checked on the same reads.
+    """
+
+    def __init__(self, clock=time.process_time):
+        """
+        :param clock: The clock the time limit is measured on.
+        """
+        self.clock = clock
+        self.start_time = 0
+        self.end_time = 0
+        self.wall_end_time = None
+        self.is_expired = True
+        self.interval = 1
+        self.polls_until_check = 1
+        self.last_check_time = 0
+
+    def start(self, time_limit, wall_time_limit=None):
+        """Starts measuring a new time limit from now.
+
+        :param time_limit: The time limit in seconds (can be float).
+        :param wall_time_limit: A limit on the wall time in seconds, or None for no limit.
+        """
+        start_time = self.clock()
+        self.start_time = start_time
+        self.end_time = start_time + time_limit
+        self.wall_end_time = None if wall_time_limit is None else time.monotonic() + wall_time_limit
+        self.is_expired = False
+        self.interval = 1
+        self.polls_until_check = 1
+        self.last_check_time = start_time
+
+    def expired(self):
+        """
+        :return: Whether the time limit has passed. May answer up to a couple of milliseconds late.
+        """
+        if self.is_expired:
+            return True
+        self.polls_until_check -= 1
+        if self.polls_until_check > 0:
+            return False
+
+        now = self.clock()
+        remaining = self.end_time - now
+        if self.wall_end_time is not None:
+            remaining = min(remaining, self.wall_end_time - time.monotonic())
+        if remaining <= 0:
+            self.is_expired = True
+            return True
+
+        # Adapting the interval to the polling rate, without sleeping past the end of the time limit.
+        elapsed = now - self.last_check_time
+        if elapsed > 0:
+            rate = self.interval / elapsed
+            self.interval = int(rate * min(DEADLINE_CHECK_PERIOD, remaining / 2))
+            self.interval = max(1, min(DEADLINE_MAX_INTERVAL, self.interval))
+        else:
+            self.interval = min(DEADLINE_MAX_INTERVAL, self.interval * 2)
+        self.polls_until_check = self.interval
+        self.last_check_time = now
+        return False
+
+    def elapsed(self):
+        """
+        :return: The time from the start to the last clock read, without reading the clock.
+        """
+        return max(0, self.last_check_time - self.start_time)
+
+
+class CancellationToken:
+    """A flag a running search checks to know it should stop as soon as possible.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class SearchExecutor:
+    """Runs functions (searches) with a time limit on a single long-lived worker thread.
+
+    Unlike run_with_limited_time, that starts a new thread for every call and leaves it running when it times out,
+    the executor cancels the timed out call through its CancellationToken, and the worker is reused for the next
+    call once the cancelled search has unwound.
+    """
+
+    def __init__(self):
+        self.jobs = Queue()
+        self.worker = Thread(target=self._work, daemon=True)
+        self.worker.start()
+        # The CPU clock of the worker thread, read by cpu_time from other threads.
+        self.worker_clock_id = None
+        if hasattr(time, 'pthread_getcpuclockid'):
+            self.worker_clock_id = time.pthread_getcpuclockid(self.worker.ident)
+
+    def cpu_time(self):
+        """A clock for the time limits of the searches run by the executor, that other threads (e.g. the opponent's
+        searches) do not advance.
+
+        :return: The CPU time in seconds the worker thread spent so far, or the CPU time of the process where the
+                 platform has no clock for the CPU time of another thread.
+        """
+        if self.worker_clock_id is None:
+            return time.process_time()
+        return time.clock_gettime(self.worker_clock_id)
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            func, args, kwargs, result_queue = job
+            start = time.thread_time()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                # Errors (e.g. MemoryError) are handed to the caller, and the worker stays alive for the next call.
+                result_queue.put(e)
+                continue
+
+            runtime = time.thread_time() - start
+            result_queue.put((result, runtime))
+
+    def shutdown(self):
+        """Stops the worker thread once the calls already submitted have returned, and waits for it. The executor can
+        not run anything afterwards.
+        """
+        self.jobs.put(None)
+        self.worker.join()
+
+    def submit(self, func, args, kwargs):
+        """Runs a function on the worker thread without waiting for it.
+
+        :param func: The function to run.
+        :param args: The functions args, given as tuple.
+        :param kwargs: The functions keywords, given as dict.
+        :return: A Queue that gets the function's result and running time as a tuple, or the exception it raised.
+        """
+        result_queue = Queue()
+        self.jobs.put((func, args, kwargs, result_queue))
+        return result_queue
+
+    def run(self, func, args, kwargs, time_limit, cancellation_token):
+        """Runs a function with time limit on the worker thread.
+
+        :param func: The function to run. It should stop soon after cancellation_token is cancelled.
+        :param args: The functions args, given as tuple.
+        :param kwargs: The functions keywords, given as dict.
+        :param time_limit: The time limit in seconds (can be float).
+        :param cancellation_token: The CancellationToken checked by func. It is cancelled if the time limit passes.
+        :return: A tuple: The function's return value unchanged, and the running time for the function.
+        :raises ExceededTimeError: If the function exceeded the time limit. The caller should fall back on the result
+                                   of its last completed call. It is raised once the cancelled function has returned,
+                                   so the objects it was given (e.g. a game state it makes and unmakes moves on) are
+                                   not in use anymore.
+        """
+        result_queue = self.submit(func, args, kwargs)
+        try:
+            result = result_queue.get(timeout=max(time_limit, 0))
+        except Empty:
+            cancellation_token.cancel()
+            result_queue.get()
+            raise ExceededTimeError
+
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+
+class TranspositionTable:
+    """A bounded table of search results, keyed by the Zobrist key of the position (GameState.key).
+
+    Every bucket has two slots: a depth-preferred slot, that is only replaced by a search at least as deep (or by
+    any search once its entry is from an older search), and an always-replace slot that takes every other store.
+    Entries are (key, depth, bound, value, move code, search id) tuples, where the move code is encode_move of the
+    best move found.
+    """
+
+    def __init__(self, memory_budget):
+        """
+        :param memory_budget: The approximate memory the table may use, in bytes.
+        """
+        self.size = max(1, memory_budget // (2 * TT_ENTRY_BYTES))
+        self.depth_slots = [None] * self.size
+        self.always_slots = [None] * self.size
+        self.search_id = 0
+
+    def new_search(self):
+        """Marks the start of a new search (a new turn). Deep entries from previous searches are kept and used,
+        but may be replaced by shallower ones from now on.
+        """
+        self.search_id += 1
+
+    def probe(self, key):
+        """
+        :param key: The key of the position.
+        :return: The entry stored for this position, or None.
+        """
+        index = key % self.size
+        entry = self.depth_slots[index]
+        if entry is not None and entry[0] == key:
+            return entry
+        entry = self.always_slots[index]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, bound, value, move_code):
+        """Stores a search result.
+
+        :param key: The key of the position.
+        :param depth: The depth the position was searched to.
+        :param bound: EXACT, LOWER_BOUND or UPPER_BOUND.
+        :param value: The value found.
+        :param move_code: The encoded best move, or None.
+        """
+        index = key % self.size
+        entry = (key, depth, bound, value, move_code, self.search_id)
+        old = self.depth_slots[index]
+        if old is None or old[0] == key or depth >= old[1] or old[5] != self.search_id:
+            self.depth_slots[index] = entry
+        else:
+            self.always_slots[index] = entry
+
+    def clear(self):
+        self.depth_slots = [None] * self.size
+        self.always_slots = [None] * self.size
+
+
+class EvaluationCache:
+    """A fixed size cache of the utilities of positions, keyed by GameState.key.
+
+    The cache is direct mapped: every key has a single slot (key % size), and storing a position evicts whatever
+    position was in its slot. Lookups and stores are a couple of list accesses, and the memory never grows.
+    """
+
+    def __init__(self, size):
+        """
+        :param size: The number of slots.
+        """
+        self.size = size
+        self.keys = [None] * size
+        self.values = [None] * size
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        """
+        :return: The part of the lookups that found their position, or 0 if there were none.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def clear(self):
+        self.keys = [None] * self.size
+        self.values = [None] * self.size
+
+
+def cached_utility(utility):
+    """Decorates the utility method of a player so its results are kept in the player's evaluation_cache (an
+    EvaluationCache, or None to not cache). The utility must only depend on the position and on whether the game is
+    drawn by MAX_TURNS_NO_JUMP; those drawn positions are not cached.
+    """
+    @functools.wraps(utility)
+    def cached(self, state):
+        cache = self.evaluation_cache
+        if cache is None or state.turns_since_last_jump >= MAX_TURNS_NO_JUMP:
+            return utility(self, state)
+        key = state.key
+        index = key % cache.size
+        if cache.keys[index] == key:
+            cache.hits += 1
+            return cache.values[index]
+        cache.misses += 1
+        value = utility(self, state)
+        cache.keys[index] = key
+        cache.values[index] = value
+        return value
+    return cached
+
+
+class MoveOrdering:
+    """Orders the moves of a search node so that alpha-beta cuts off as early as possible.
+
+    The moves are tried in this order:
+     1. The transposition table move (the best move found by the previous iteration).
+     2. Captures, the ones eating more tools first.
+     3. The two killer moves of the current ply (quiet moves that caused a cutoff in a sibling node).
+     4. The rest, by their history heuristic score, which grows every time a move with the same
+        (origin, target) causes a cutoff anywhere in the tree.
+
+    The killers and the history are kept by the origin and target bits of the move codes (see GameMove), the history
+    as a list indexed by them.
+
+    It also counts the cutoffs, and how many of them happened on the first move tried.
+    """
+
+    def __init__(self):
+        self.killers = []
+        self.history = [0] * (ORIGIN_TARGET_MASK + 1)
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def new_search(self):
+        """Prepares the ordering for a new search (a new turn): the killers are forgotten, the history scores
+        are halved so they keep their relative order but adapt to the new position, and the statistics are reset.
+        """
+        self.killers = []
+        self.history = [score // 2 for score in self.history]
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def order(self, moves, ply, tt_move_code=None):
+        """
+        :param moves: The moves of the node.
+        :param ply: The distance of the node from the root.
+        :param tt_move_code: The encoded transposition table move of the node, or None.
+        :return: A new list with the moves ordered.
+        """
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        history = self.history
+
+        def sort_key(move):
+            origin_target = move.code & ORIGIN_TARGET_MASK
+            return (-len(move.jumped_locs), origin_target not in killers, -history[origin_target])
+
+        ordered = sorted(moves, key=sort_key)
+        if tt_move_code is not None:
+            for i, move in enumerate(ordered):
+                if move.code == tt_move_code:
+                    ordered.insert(0, ordered.pop(i))
+                    break
+        return ordered
+
+    def staged_moves(self, state, ply, tt_move_code=None):
+        """Generates the moves of a node in the order of order, but in stages, so the moves after a cutoff are
+        usually never generated:
+         1. If the player can capture, the captures (they are mandatory, so there is nothing else), all ordered.
+         2. Otherwise the transposition table move and the killers, when they can be played in the state, which does
+            not need the other moves.
+         3. The rest of the single moves, generated and ordered by their history score only when they are reached.
+        The root (ply 0) always gets all its moves ordered by order.
+
+        :param state: The state of the node (see GameState.generate_moves).
+        :param ply: The distance of the node from the root.
+        :param tt_move_code: The encoded transposition table move of the node, or None.
+        """
+        if ply == 0:
+            for move in self.order(state.get_possible_moves(), ply, tt_move_code):
+                yield move
+            return
+
+        captures = list(state.generate_captures())
+        if captures:
+            for move in self.order(captures, ply, tt_move_code):
+                yield move
+            return
+
+        history = self.history
+        # The codes of the moves already tried.
+        tried = set()
+        if tt_move_code is not None:
+            move = state.legal_single_move(tt_move_code)
+            if move is not None:
+                tried.add(move.code)
+                yield move
+
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        if len(killers) == 2 and history[killers[1]] > history[killers[0]]:
+            killers = killers[::-1]
+        for killer in killers:
+            if killer not in tried:
+                move = state.legal_single_move(killer)
+                if move is not None:
+                    tried.add(killer)
+                    yield move
+
+        rest = [move for move in state.calc_single_moves() if move.code not in tried]
+        rest.sort(key=lambda move: -history[move.code])
+        for move in rest:
+            yield move
+
+    def record_cutoff(self, move, ply, depth, first_move):
+        """Updates the killers, history and statistics after a move caused a cutoff.
+
+        :param move: The move that caused the cutoff.
+        :param ply: The distance of the node from the root.
+        :param depth: The remaining depth of the node.
+        :param first_move: Whether it was the first move tried in the node.
+        """
+        self.cutoffs += 1
+        if first_move:
+            self.first_move_cutoffs += 1
+
+        # Captures are already tried first, the killers and history are for quiet moves.
+        if move.jumped_locs:
+            return
+        origin_target = move.code & ORIGIN_TARGET_MASK
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        killers = self.killers[ply]
+        if origin_target not in killers:
+            killers.insert(0, origin_target)
+            del killers[2:]
+        self.history[origin_target] += max(depth, 1) ** 2
+
+    def first_move_cutoff_rate(self):
+        """
+        :return: The part of the cutoffs that happened on the first move tried, or 0 if there were none. The closer
+                 it is to 1, the closer the search is to the minimal alpha-beta tree.
+        """
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0
+
+
 class MiniMaxWithAlphaBetaPruning:
 
-    def __init__(self, utility, my_color, no_more_time, selective_deepening):
+    def __init__(self, utility, my_color, no_more_time, selective_deepening, transposition_table=None,
+                 move_ordering=None, max_quiescence_depth=None, cancellation_token=None, principal_variation=False,
+                 tablebase=None):
         """Initialize a MiniMax algorithms with alpha-beta pruning.
 
         :param utility: The utility function. Should have state as parameter.
@@ -74,50 +568,382 @@ class MiniMaxWithAlphaBetaPruning:
         :param selective_deepening: A functions that gets the current state, and
                         returns True when the algorithm should continue the search
                         for the minimax value recursivly from this state.
+        :param transposition_table: An optional TranspositionTable. It should only be shared between searches of the
+                        same player (the values are from my_color's point of view), and can be kept across depths
+                        and turns.
+        :param move_ordering: An optional MoveOrdering, used to order the moves of every node.
+        :param max_quiescence_depth: If given, the nodes at the depth limit are evaluated with a quiescence search of
+                        at most this many plies instead of using selective_deepening (see quiescence).
+        :param cancellation_token: An optional CancellationToken. Once it is cancelled the search stops as if it ran
+                        out of time.
+        :param principal_variation: Whether to run a principal variation search: only the first move of every node
+                        is searched with the full window, the others with a null window that only proves they are
+                        not better, and are re-searched if they are. Works best with a move_ordering.
+        :param tablebase: An optional checkers.tablebase.TablebaseProber. The nodes below the root it has a result
+                        for get their exact value without being searched (see tablebase_value).
         """
         self.utility = utility
         self.my_color = my_color
         self.no_more_time = no_more_time
         self.selective_deepening = selective_deepening
+        self.transposition_table = transposition_table
+        self.move_ordering = move_ordering
+        self.max_quiescence_depth = max_quiescence_depth
+        self.quiescence_nodes = 0
+        self.cancellation_token = cancellation_token
+        self.principal_variation = principal_variation
+        self.tablebase = tablebase
+
+    def out_of_time(self):
+        """
+        :return: Whether the search should stop: its time is up or it was cancelled.
+        """
+        return self.no_more_time() or (self.cancellation_token is not None and self.cancellation_token.cancelled)
 
-    def search(self, state, depth, alpha, beta, maximizing_player):
+    def search(self, state, depth, alpha, beta, maximizing_player, ply=0):
         """Start the MiniMax algorithm.
+        The moves are performed and taken back on the given state in place (see GameState.make_move), so it is
+        left unchanged when the search returns.
 
         :param state: The state to start from.
         :param depth: The maximum allowed depth for the algorithm.
         :param alpha: The alpha of the alpha-beta pruning.
         :param alpha: The beta of the alpha-beta pruning.
         :param maximizing_player: Whether this is a max node (True) or a min node (False).
+        :param ply: The distance from the root of the search. Only the recursion sets it.
         :return: A tuple: (The alpha-beta algorithm value, The move in case of max node or None in min mode)
         """
-        if self.no_more_time() or (depth <= 0 and not self.selective_deepening(state)):
+        if self.out_of_time():
             return self.utility(state), None
+        if self.tablebase is not None and ply > 0:
+            entry = self.tablebase.probe(state)
+            if entry is not None:
+                return self.tablebase_value(state, ply, *entry), None
+        if depth <= 0:
+            if self.max_quiescence_depth is not None:
+                return self.quiescence(state, alpha, beta, maximizing_player, self.max_quiescence_depth), None
+            if not self.selective_deepening(state):
+                return self.utility(state), None
 
-        next_moves = state.get_possible_moves()
-        if not next_moves:
-            # This player has no moves. So the previous player is the winner.
-            return INFINITY if state.curr_player != self.my_color else -INFINITY, None
+        table = self.transposition_table
+        tt_move_code = None
+        # The move of an entry is still good for ordering the moves where its value can not be used.
+        use_table_values = not reaches_no_jump_draw(state, depth)
+        if table is not None:
+            entry = table.probe(state.key)
+            if entry is not None:
+                _, entry_depth, bound, value, tt_move_code, _ = entry
+                value = value_from_table(value, ply)
+                if ply > 0 and use_table_values and entry_depth >= depth and (
+                        bound == EXACT
+                        or (bound == LOWER_BOUND and value >= beta)
+                        or (bound == UPPER_BOUND and value <= alpha)):
+                    return value, None
+
+        # The moves are generated lazily, so the ones after a cutoff are usually never generated.
+        ordering = self.move_ordering
+        if ordering is not None:
+            next_moves = ordering.staged_moves(state, ply, tt_move_code)
+        else:
+            next_moves = state.generate_moves()
 
+        orig_alpha, orig_beta = alpha, beta
+        timed_out = False
+        selected_move = None
         if maximizing_player:
-            selected_move = next_moves[0]
             best_move_utility = -INFINITY
-            for move in next_moves:
-                new_state = copy.deepcopy(state)
-                new_state.perform_move(move)
-                minimax_value, _ = self.search(new_state, depth - 1, alpha, beta, False)
+            for i, move in enumerate(next_moves):
+                if i == 0:
+                    selected_move = move
+                undo = state.make_move(move)
+                if i > 0 and self.principal_variation:
+                    minimax_value, _ = self.search(state, depth - 1, alpha, min(beta, alpha + NULL_WINDOW), False,
+                                                   ply + 1)
+                    if alpha < minimax_value < beta:
+                        minimax_value, _ = self.search(state, depth - 1, alpha, beta, False, ply + 1)
+                else:
+                    minimax_value, _ = self.search(state, depth - 1, alpha, beta, False, ply + 1)
+                state.unmake_move(undo)
+                # The value of a child cut by the time limit is not reliable, so it is not used.
+                if self.out_of_time():
+                    timed_out = True
+                    break
                 alpha = max(alpha, minimax_value)
                 if minimax_value > best_move_utility:
                     best_move_utility = minimax_value
                     selected_move = move
-                if beta <= alpha or self.no_more_time():
+                if beta <= alpha:
+                    if ordering is not None:
+                        ordering.record_cutoff(move, ply, depth, i == 0)
                     break
-            return alpha, selected_move
+            value = alpha
+
+        else:
+            best_move_utility = INFINITY
+            for i, move in enumerate(next_moves):
+                if i == 0:
+                    selected_move = move
+                undo = state.make_move(move)
+                if i > 0 and self.principal_variation:
+                    minimax_value, _ = self.search(state, depth - 1, max(alpha, beta - NULL_WINDOW), beta, True,
+                                                   ply + 1)
+                    if alpha < minimax_value < beta:
+                        minimax_value, _ = self.search(state, depth - 1, alpha, beta, True, ply + 1)
+                else:
+                    minimax_value, _ = self.search(state, depth - 1, alpha, beta, True, ply + 1)
+                state.unmake_move(undo)
+                # The value of a child cut by the time limit is not reliable, so it is not used.
+                if self.out_of_time():
+                    timed_out = True
+                    break
+                beta = min(beta, minimax_value)
+                if minimax_value < best_move_utility:
+                    best_move_utility = minimax_value
+                    selected_move = move
+                if beta <= alpha:
+                    if ordering is not None:
+                        ordering.record_cutoff(move, ply, depth, i == 0)
+                    break
+            value = beta
+
+        if selected_move is None:
+            # This player has no moves. So the previous player is the winner.
+            return INFINITY if state.curr_player != self.my_color else -INFINITY, None
+
+        # A search cut by the time limit does not have a reliable value, so it is not stored.
+        if table is not None and use_table_values and not timed_out:
+            if value <= orig_alpha:
+                bound = UPPER_BOUND
+            elif value >= orig_beta:
+                bound = LOWER_BOUND
+            else:
+                bound = EXACT
+            table.store(state.key, depth, bound, value_to_table(value, ply), selected_move.code)
+
+        return value, selected_move if maximizing_player else None
+
+    def tablebase_value(self, state, ply, result, distance):
+        """
+        :param state: The probed state.
+        :param ply: The distance of the state from the root of the search.
+        :param result: The result of the player to move.
+        :param distance: The distance to the end of the game in plies, or None if unknown.
+        :return: The value of a tablebase result for my_color: 0 for a draw, and a win or loss closer to INFINITY
+                 the sooner (counted from the root) it ends, so the search goes for the fastest win.
+        """
+        if result == DRAW:
+            return 0
+        value = INFINITY - ply - (MAX_DISTANCE if distance is None else distance)
+        if (result == WIN) != (state.curr_player == self.my_color):
+            return -value
+        return value
+
+    def aspiration_search(self, state, depth, guess, window=ASPIRATION_WINDOW):
+        """Searches the root (a max node) with a narrow window around a guess of its value, typically the value found
+        by the previous iteration of iterative deepening. When the value falls outside the window, the failing side
+        of the window is widened (doubling every time) and the root is searched again.
+
+        :param state: The state to start from.
+        :param depth: The maximum allowed depth for the algorithm.
+        :param guess: The expected value. If it is None or a win/loss value, a full window search is done.
+        :param window: The initial half width of the window.
+        :return: A tuple: (The alpha-beta algorithm value, The move)
+        """
+        if guess is None or abs(guess) >= INFINITY:
+            return self.search(state, depth, -INFINITY, INFINITY, True)
+
+        low_window = high_window = window
+        while True:
+            alpha = max(-INFINITY, guess - low_window)
+            beta = min(INFINITY, guess + high_window)
+            value, move = self.search(state, depth, alpha, beta, True)
+            if self.out_of_time():
+                return value, move
+            if value <= alpha and alpha > -INFINITY:
+                low_window *= 2
+            elif value >= beta and beta < INFINITY:
+                high_window *= 2
+            else:
+                return value, move
+
+    def quiescence(self, state, alpha, beta, maximizing_player, depth):
+        """Evaluates a node at the depth limit without stopping in the middle of an exchange.
+        A quiet node (no capture available) stands pat on its utility. Since capturing is mandatory, a node with
+        captures has no quiet alternative to stand pat on, so its captures are searched with alpha-beta, for at most
+        the given number of plies. The nodes visited are counted in quiescence_nodes.
+
+        :param state: The state to evaluate.
+        :param alpha: The alpha of the alpha-beta pruning.
+        :param beta: The beta of the alpha-beta pruning.
+        :param maximizing_player: Whether this is a max node (True) or a min node (False).
+        :param depth: The number of capture plies still allowed.
+        :return: The value of the node.
+        """
+        self.quiescence_nodes += 1
+        if depth <= 0 or self.out_of_time():
+            return self.utility(state)
+        next_moves = list(state.generate_captures())
+        if not next_moves:
+            return self.utility(state)
+
+        # There are captures, so all the possible moves are captures. The longer ones are tried first.
+        next_moves.sort(key=lambda move: -len(move.jumped_locs))
+        if maximizing_player:
+            for move in next_moves:
+                undo = state.make_move(move)
+                alpha = max(alpha, self.quiescence(state, alpha, beta, False, depth - 1))
+                state.unmake_move(undo)
+                if beta <= alpha:
+                    break
+            return alpha
 
         else:
             for move in next_moves:
-                new_state = copy.deepcopy(state)
-                new_state.perform_move(move)
-                beta = min(beta, self.search(new_state, depth - 1, alpha, beta, True)[0])
-                if beta <= alpha or self.no_more_time():
+                undo = state.make_move(move)
+                beta = min(beta, self.quiescence(state, alpha, beta, True, depth - 1))
+                state.unmake_move(undo)
+                if beta <= alpha:
                     break
-            return beta, None
+            return beta
+
+
+class SearchStatistics:
+    """Statistics of the iterations of a search (see InstrumentedMiniMax), kept in iterations as dictionaries and
+    optionally appended to a JSON lines file, one line per iteration.
+
+    The counters of the running iteration are plain attributes, updated by the instrumented search.
+    """
+
+    def __init__(self, log_path=None):
+        """
+        :param log_path: The path of a JSON lines file the iterations are appended to, or None.
+        """
+        self.log_path = log_path
+        self.iterations = []
+        self.in_iteration = False
+        self.previous_nodes = None
+        self.reset_counters(0)
+
+    def reset_counters(self, depth):
+        self.depth = depth
+        self.nodes = 0
+        self.expanded_nodes = 0
+        self.leaf_evaluations = 0
+        self.selective_deepening_nodes = 0
+        self.beta_cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.max_ply = 0
+        self.quiescence_nodes = 0
+
+    def new_move(self):
+        """Starts the statistics of a new move: the branching factor is only measured between iterations of a move.
+        """
+        self.previous_nodes = None
+
+    def begin_iteration(self, depth):
+        self.reset_counters(depth)
+        self.in_iteration = True
+        self.start_time = time.process_time()
+
+    def end_iteration(self, completed, **fields):
+        """Records the running iteration.
+
+        :param completed: Whether the iteration finished (False when it was stopped by the time limit).
+        :param fields: More fields to record, e.g. the player.
+        :return: The record of the iteration.
+        """
+        run_time = time.process_time() - self.start_time
+        record = dict(fields)
+        record.update({
+            'depth': self.depth,
+            'completed': completed,
+            'nodes': self.nodes,
+            'leaf_evaluations': self.leaf_evaluations,
+            'quiescence_nodes': self.quiescence_nodes,
+            'selective_deepening_nodes': self.selective_deepening_nodes,
+            'max_ply': self.max_ply,
+            'time': run_time,
+            'nodes_per_second': self.nodes / run_time if run_time > 0 else None,
+            # The growth of the tree from the previous depth.
+            'effective_branching_factor': self.nodes / self.previous_nodes if self.previous_nodes else None,
+            'beta_cutoff_rate': self.beta_cutoffs / self.expanded_nodes if self.expanded_nodes else 0,
+            'first_move_cutoff_rate': self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0,
+        })
+        self.in_iteration = False
+        self.previous_nodes = self.nodes
+        self.iterations.append(record)
+        if self.log_path is not None:
+            with open(self.log_path, 'a') as log_file:
+                log_file.write(json.dumps(record) + '\n')
+        return record
+
+
+class InstrumentedMiniMax(MiniMaxWithAlphaBetaPruning):
+    """A MiniMaxWithAlphaBetaPruning that collects SearchStatistics. Every call to search at the root or to
+    aspiration_search is an iteration.
+
+    The counting is only in this subclass, so searches that are not instrumented do not pay for it.
+    """
+
+    def __init__(self, minimax, statistics):
+        """
+        :param minimax: The MiniMaxWithAlphaBetaPruning to instrument. The instrumented search has the same settings.
+        :param statistics: The SearchStatistics to update.
+        """
+        self.__dict__.update(minimax.__dict__)
+        self.statistics = statistics
+        # The number of children searched so far by every node on the current path.
+        self.child_counts = []
+
+        utility = self.utility
+
+        def counted_utility(state):
+            statistics.leaf_evaluations += 1
+            return utility(state)
+        self.utility = counted_utility
+
+    def _begin_iteration(self, depth):
+        if self.statistics.in_iteration:
+            return False
+        self.statistics.begin_iteration(depth)
+        self.quiescence_nodes_start = self.quiescence_nodes
+        return True
+
+    def _end_iteration(self):
+        self.statistics.quiescence_nodes = self.quiescence_nodes - self.quiescence_nodes_start
+        self.statistics.end_iteration(not self.out_of_time(), player=self.my_color)
+
+    def search(self, state, depth, alpha, beta, maximizing_player, ply=0):
+        statistics = self.statistics
+        iteration = ply == 0 and self._begin_iteration(depth)
+        statistics.nodes += 1
+        if ply > statistics.max_ply:
+            statistics.max_ply = ply
+        child_counts = self.child_counts
+        if child_counts:
+            child_counts[-1] += 1
+        child_counts.append(0)
+        try:
+            value, move = MiniMaxWithAlphaBetaPruning.search(self, state, depth, alpha, beta, maximizing_player, ply)
+            children = child_counts[-1]
+            if children:
+                statistics.expanded_nodes += 1
+                if depth <= 0:
+                    statistics.selective_deepening_nodes += 1
+                if value >= beta if maximizing_player else value <= alpha:
+                    statistics.beta_cutoffs += 1
+                    if children == 1:
+                        statistics.first_move_cutoffs += 1
+            return value, move
+        finally:
+            child_counts.pop()
+            if iteration:
+                self._end_iteration()
+
+    def aspiration_search(self, state, depth, guess, window=ASPIRATION_WINDOW):
+        iteration = self._begin_iteration(depth)
+        try:
+            return MiniMaxWithAlphaBetaPruning.aspiration_search(self, state, depth, guess, window)
+        finally:
+            if iteration:
+                self._end_iteration()